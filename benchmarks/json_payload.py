@@ -0,0 +1,87 @@
+"""
+Compare encoding scan_hkl payloads through FastAPI's jsonable_encoder against
+NumpyJSONResponse, with and without orjson.
+
+    python benchmarks/json_payload.py [--points 10000] [--repeat 5]
+
+Solving 10k points takes minutes, so a small grid is solved once and its solutions
+repeated until the scan has the requested number of points.
+"""
+
+import asyncio
+import timeit
+from argparse import ArgumentParser
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from scan_hkl import BenchStore
+from serialization import build_crystal
+
+from diffcalc_API import responses
+from diffcalc_API.responses import NumpyJSONResponse
+from diffcalc_API.services import hkl as service
+from diffcalc_API.services.scans import ScanFormat, ScanResult
+
+
+def build_scan(points: int) -> ScanResult:
+    store = BenchStore(build_crystal(reflections=1))
+    service.SCAN_PARALLEL_MIN_POINTS = points + 1
+    small = asyncio.run(
+        service.scan_hkl("bench", (1, 0, 1), (2, 0, 2), (0.25, 0, 0.25), 1.0, store)
+    )
+
+    repeats = -(-points // len(small.keys))
+    coordinates = {
+        name: np.tile(values, repeats)[:points]
+        for name, values in small.coordinates.items()
+    }
+    keys = [f"{key} #{i}" for i in range(repeats) for key in small.keys][:points]
+    solutions = (list(small.solutions) * repeats)[:points]
+    return ScanResult(coordinates, keys, solutions)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    scan = build_scan(args.points)
+    payloads = {
+        scan_format.value: {"payload": scan.render(scan_format)}
+        for scan_format in ScanFormat
+    }
+
+    def jsonable(content):
+        if isinstance(content["payload"], dict) and "point" in content["payload"]:
+            # the columnar arrays as the routes would have had to list them
+            content = {
+                "payload": {k: v.tolist() for k, v in content["payload"].items()}
+            }
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def stdlib(content):
+        responses.encode_json = responses.dumps_stdlib
+        return NumpyJSONResponse(content).body
+
+    def fast(content):
+        responses.encode_json = responses.dumps_orjson
+        return NumpyJSONResponse(content).body
+
+    encoders = {"jsonable_encoder": jsonable, "NumpyJSONResponse": stdlib}
+    if responses.orjson is not None:
+        encoders["NumpyJSONResponse+orjson"] = fast
+
+    print(f"{'format':<10}{'encoder':<28}{'size (MB)':>10}{'time (ms)':>12}")
+    for scan_format, content in payloads.items():
+        for label, encode in encoders.items():
+            size = len(encode(content)) / 1e6
+            seconds = min(
+                timeit.repeat(lambda: encode(content), number=1, repeat=args.repeat)
+            )
+            print(f"{scan_format:<10}{label:<28}{size:>10.2f}{seconds * 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
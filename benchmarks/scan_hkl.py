@@ -0,0 +1,68 @@
+"""
+Compare scan_hkl solved serially on the heavy compute lane against the process pool.
+
+    python benchmarks/scan_hkl.py [--steps 20] [--processes 4] [--chunk 100]
+
+The grid is steps x 1 x steps points in h and l.
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+
+from serialization import build_crystal
+
+from diffcalc_API.services import hkl as service
+from diffcalc_API.services import parallel
+from diffcalc_API.stores.versions import StateVersions
+
+
+class BenchStore:
+    def __init__(self, hkl) -> None:
+        self.hkl = hkl
+        self.versions = StateVersions()
+
+    async def load(self, name: str):
+        return self.hkl
+
+
+def run_scan(store: BenchStore, steps: int) -> float:
+    inc = 1 / (steps - 1)
+    start = time.perf_counter()
+    asyncio.run(
+        service.scan_hkl("bench", (1, 0, 1), (2, 0, 2), (inc, 0, inc), 1.0, store)
+    )
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--chunk", type=int, default=100)
+    args = parser.parse_args()
+
+    store = BenchStore(build_crystal(reflections=1))
+    points = args.steps**2
+
+    service.SCAN_PARALLEL_MIN_POINTS = points + 1
+    run_scan(store, 2)
+    serial = run_scan(store, args.steps)
+
+    service.SCAN_PARALLEL_MIN_POINTS = 0
+    parallel.SCAN_PROCESSES = args.processes
+    parallel.SCAN_CHUNK_POINTS = args.chunk
+    try:
+        run_scan(store, 2)  # start the workers outside the timing
+        pooled = run_scan(store, args.steps)
+    finally:
+        parallel.shutdown_scan_pool()
+
+    print(f"{'mode':<24}{'points':>8}{'time (s)':>12}{'speedup':>10}")
+    print(f"{'serial':<24}{points:>8}{serial:>12.2f}{1:>10.2f}")
+    label = f"pool ({args.processes} processes)"
+    print(f"{label:<24}{points:>8}{pooled:>12.2f}{serial / pooled:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare load/save latency and file size of raw pickles against the compact format.
+
+    python benchmarks/serialization.py [--reflections 20] [--repeat 200]
+"""
+
+import pickle
+import timeit
+from argparse import ArgumentParser
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_API.stores.serialization import COMPRESSIONS, decode, encode
+
+
+def build_crystal(reflections: int) -> HklCalculation:
+    hkl = HklCalculation(UBCalculation(name="bench"), Constraints())
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    hkl.ubcalc.n_hkl = (1, 0, 0)
+    for i in range(reflections):
+        hkl.ubcalc.add_reflection(
+            (0, 0, 1), Position(7.31, 0, 10.62, 0, 0, i), 12.39842, f"refl{i}"
+        )
+    hkl.ubcalc.add_orientation((0, 1, 0), (0, 1, 0), None, "plane")
+    hkl.ubcalc.calc_ub("refl0", "plane")
+    hkl.constraints = Constraints({"qaz": 0, "alpha": 0, "eta": 0})
+    return hkl
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--reflections", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    hkl = build_crystal(args.reflections)
+    formats = {"pickle": (pickle.dumps, pickle.loads)}
+    for compression in COMPRESSIONS:
+        formats[f"compact/{compression}"] = (
+            lambda calc, c=compression: encode(calc, c),
+            decode,
+        )
+
+    print(f"{'format':<16}{'bytes':>10}{'save (us)':>12}{'load (us)':>12}")
+    for label, (dumps, loads) in formats.items():
+        data = dumps(hkl)
+        save = timeit.timeit(lambda: dumps(hkl), number=args.repeat) / args.repeat
+        load = timeit.timeit(lambda: loads(data), number=args.repeat) / args.repeat
+        print(f"{label:<16}{len(data):>10}{save * 1e6:>12.1f}{load * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
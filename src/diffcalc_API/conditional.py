@@ -0,0 +1,75 @@
+"""
+Conditional GETs on crystal state.
+
+Read-only routes depend on check_etag, which derives an ETag from the state tag
+the store gives the crystal, such as its file stamp or row version, and answers a
+matching If-None-Match with 304 Not Modified before the crystal is loaded. Routes
+on a ConditionalRoute router send the ETag with every successful response.
+"""
+
+from typing import Callable, Coroutine, Optional
+
+from fastapi import Depends, Request
+from fastapi.routing import APIRoute
+from starlette.responses import Response
+
+from diffcalc_API.responses import NPZ, accepts
+from diffcalc_API.stores.factory import get_store
+from diffcalc_API.stores.protocol import HklCalcStore
+
+
+class NotModified(Exception):
+    def __init__(self, etag: str) -> None:
+        self.etag = etag
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # weak comparison, as for GET requests
+    return "*" in tags or etag in (
+        tag[2:] if tag.startswith("W/") else tag for tag in tags
+    )
+
+
+def make_etag(tag: str, variant: str = "") -> str:
+    return f'"{tag}{variant}"'
+
+
+async def check_etag(
+    name: str, request: Request, store: HklCalcStore = Depends(get_store)
+) -> Optional[str]:
+    tag = await store.state_tag(name)
+    if tag is None:
+        # not stored, which the route itself reports
+        return None
+
+    etag = make_etag(tag, "-npz" if accepts(request, NPZ) else "")
+    request.state.etag = etag
+    if matches(request.headers.get("if-none-match"), etag):
+        raise NotModified(etag)
+
+    return etag
+
+
+class ConditionalRoute(APIRoute):
+    """
+    Adds the ETag worked out by check_etag, if the route depends on it, to
+    successful responses.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine]:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            response = await handler(request)
+
+            etag = getattr(request.state, "etag", None)
+            if etag is not None and response.status_code == 200:
+                response.headers["ETag"] = etag
+                response.headers["Vary"] = "Accept"
+            return response
+
+        return route_handler
@@ -1,6 +1,45 @@
 # this file is for defining constants
 
+# one of "pickling", "compact", "journal", "sqlite", "memory"
+STORE_BACKEND = "pickling"
 SAVE_PICKLES_FOLDER = "/dls/tmp/ton99817/diffcalc_pickles"
+MEMORY_SNAPSHOT_FOLDER = (
+    "/dls/tmp/ton99817/diffcalc_snapshots"  # not readable as pickles
+)
+MEMORY_SNAPSHOT_INTERVAL = 30.0  # seconds
+SQLITE_DATABASE = "/tmp/diffcalc_API/crystals.sqlite"  # keep off NFS for WAL mode
+SQLITE_POOL_SIZE = 4
+SQLITE_BUSY_TIMEOUT = 5.0  # seconds
+STORE_CACHE_MAX_ENTRIES = 128
+STORE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+STORE_IO_WORKERS = 8
+STORE_WRITE_BEHIND_DELAY = 0.0  # seconds; 0 writes every save straight to disk
+FILE_LOCK_POLL_INTERVAL = 0.01  # seconds; only polled while another process holds it
+STORE_COMPRESSION = "none"  # one of "none", "zlib", "lzma"
+JOURNAL_COMPACT_OPS = 100
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+LIST_PAGE_SIZE = 100
+LIST_PAGE_SIZE_MAX = 1000
+BATCH_MAX_ENTRIES = 10000
+BATCH_MAX_POSITIONS = 1000000
+TRAJECTORY_CHUNK_ROWS = 10000
+COMPUTE_WORKERS = 4
+COMPUTE_MAX_CONCURRENCY = 4
+COMPUTE_HEAVY_WORKERS = 2  # whole scans and batches
+COMPUTE_HEAVY_MAX_CONCURRENCY = 2
+SCAN_PROCESSES = 4  # 0 solves every scan on the event loop
+SCAN_PARALLEL_MIN_POINTS = 500
+SCAN_CHUNK_POINTS = 100
+POSITION_CACHE_ENTRIES = 4096
+POSITION_CACHE_DATABASE = ""  # an SQLite file keeps results across restarts
+POSITION_CACHE_DISK_ENTRIES = 1000000
+EVENTS_QUEUE_SIZE = 16
+EVENTS_POLL_INTERVAL = 5.0  # seconds; checks for changes by other processes
+JOBS_MAX_RUNNING = 4
+JOBS_MAX_RUNNING_PER_CRYSTAL = 2
+JOBS_PROCESSES = 2  # 0 solves jobs on the threads running them
+JOBS_CHUNK_POINTS = 100
+JOBS_RESULT_TTL = 600.0  # seconds a finished job and its results are kept
 VECTOR_PROPERTIES = ["n_hkl", "n_phi", "surf_nhkl", "surf_nphi"]
 CONSTRAINTS_WITH_NO_VALUE = {"a_eq_b", "bin_eq_bout", "mu_is_gam", "bisect"}
 
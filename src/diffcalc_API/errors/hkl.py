@@ -1,8 +1,9 @@
-from typing import Optional, Tuple, Union
+from typing import Iterable, Optional, Tuple, Union
 
 import numpy as np
 from diffcalc.hkl.calc import HklCalculation
 
+from diffcalc_API.config import BATCH_MAX_ENTRIES
 from diffcalc_API.errors.definitions import (
     ALL_RESPONSES,
     DiffcalcAPIException,
@@ -14,6 +15,10 @@ class Codes(ErrorCodes):
     CHECK_VALID_MILLER_INDICES = 400
     CHECK_VALID_SCAN_BOUNDS = 400
     CALCULATE_UB_MATRIX = 400
+    CHECK_BATCH_SIZE = 400
+    CHECK_UB_CALCULATED = 400
+    CHECK_VALID_WAVELENGTHS = 400
+    CHECK_TRAJECTORY_FORMAT = 415
 
 
 responses = {code: ALL_RESPONSES[code] for code in np.unique(Codes().all_codes())}
@@ -40,6 +45,56 @@ def check_valid_scan_bounds(start: float, stop: float, inc: float):
     return
 
 
+def check_batch_size(entries: int, limit: int = BATCH_MAX_ENTRIES) -> None:
+    if entries > limit:
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_BATCH_SIZE,
+            detail=(
+                f"Batch of {entries} entries is too large, "
+                f"send at most {limit} per request"
+            ),
+        )
+    return
+
+
+def check_ub_calculated(hkl: HklCalculation) -> None:
+    if hkl.ubcalc.UB is None:
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_UB_CALCULATED,
+            detail="UB matrix not calculated yet, calculate it first",
+        )
+    return
+
+
+def check_valid_wavelengths(wavelengths: np.ndarray, entries: int) -> None:
+    if wavelengths.size not in (1, entries):
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_VALID_WAVELENGTHS,
+            detail=(
+                f"Expected one wavelength, or one for each of the {entries} "
+                f"positions, but got {wavelengths.size}"
+            ),
+        )
+    if np.any(wavelengths <= 0):
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_VALID_WAVELENGTHS,
+            detail="Wavelengths must be positive",
+        )
+    return
+
+
+def check_trajectory_format(media_type: str, supported: Iterable[str]) -> None:
+    if media_type not in supported:
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_TRAJECTORY_FORMAT,
+            detail=(
+                f"Cannot read trajectories of type {media_type or 'unknown'}, "
+                f"send one of {', '.join(supported)}"
+            ),
+        )
+    return
+
+
 def calculate_ub_matrix(
     hkl: HklCalculation,
     first_tag: Optional[Union[int, str]],
@@ -0,0 +1,33 @@
+from typing import Container
+
+import numpy as np
+
+from diffcalc_API.errors.definitions import (
+    ALL_RESPONSES,
+    DiffcalcAPIException,
+    ErrorCodes,
+)
+
+
+class Codes(ErrorCodes):
+    CHECK_JOB_EXISTS = 404
+    CHECK_JOB_FINISHED = 409
+
+
+responses = {code: ALL_RESPONSES[code] for code in np.unique(Codes().all_codes())}
+
+
+def check_job_exists(job_id: str, jobs: Container[str]) -> None:
+    if job_id not in jobs:
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_JOB_EXISTS,
+            detail=f"Job {job_id} does not exist, or its results have expired",
+        )
+
+
+def check_job_finished(job_id: str, status: str) -> None:
+    if status != "finished":
+        raise DiffcalcAPIException(
+            status_code=Codes.CHECK_JOB_FINISHED,
+            detail=f"Job {job_id} is {status}, results are ready once it has finished",
+        )
@@ -1,3 +1,3 @@
-from diffcalc_API.examples import ub
+from diffcalc_API.examples import hkl, ub
 
-__all__ = ["ub"]
+__all__ = ["hkl", "ub"]
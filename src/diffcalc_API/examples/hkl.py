@@ -0,0 +1,17 @@
+from diffcalc_API.models.hkl import (
+    LabPositionBatchParams,
+    MillerIndicesBatchParams,
+    MillerIndicesParams,
+)
+
+lab_position_batch: LabPositionBatchParams = LabPositionBatchParams(
+    entries=[
+        MillerIndicesParams(miller_indices=(0, 0, 1), wavelength=1.0),
+        MillerIndicesParams(miller_indices=(1, 0, 1), wavelength=1.0),
+    ]
+)
+
+miller_indices_batch: MillerIndicesBatchParams = MillerIndicesBatchParams(
+    positions=[(7.31, 0, 10.62, 0, 0, 0), (7.31, 0, 10.62, 0, 5, 0)],
+    wavelength=1.0,
+)
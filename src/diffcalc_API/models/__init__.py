@@ -1,3 +1,3 @@
-from diffcalc_API.models import ub
+from diffcalc_API.models import hkl, ub
 
-__all__ = ["ub"]
+__all__ = ["hkl", "ub"]
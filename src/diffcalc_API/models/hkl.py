@@ -0,0 +1,23 @@
+from typing import List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+
+class MillerIndicesParams(BaseModel):
+    miller_indices: Tuple[float, float, float]
+    wavelength: float
+
+
+class LabPositionBatchParams(BaseModel):
+    entries: List[MillerIndicesParams]
+
+
+class MillerIndicesBatchParams(BaseModel):
+    positions: List[Tuple[float, float, float, float, float, float]]
+    wavelength: Union[float, List[float]]
+
+
+class LivePositionParams(BaseModel):
+    pos: Tuple[float, float, float, float, float, float]
+    wavelength: float
+    id: Optional[Union[int, str]] = None
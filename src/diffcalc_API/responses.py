@@ -0,0 +1,91 @@
+import io
+import json
+import math
+from typing import Any, Dict
+
+import numpy as np
+from fastapi import Request
+from starlette.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+NPZ = "application/x-npz"
+
+
+def accepts(request: Request, media_type: str) -> bool:
+    accept = request.headers.get("accept", "")
+    return media_type in (part.split(";")[0].strip() for part in accept.split(","))
+
+
+def _numpy_default(value: Any) -> Any:
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _finite(value: Any) -> Any:
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return _finite(value.tolist())
+    return value
+
+
+def dumps_stdlib(content: Any) -> bytes:
+    """
+    Like orjson, writes NaN and infinity as null, since JSON has no literal for
+    them. Content is only copied to replace them when the first attempt finds one.
+    """
+    try:
+        encoded = json.dumps(
+            content, default=_numpy_default, separators=(",", ":"), allow_nan=False
+        )
+    except ValueError:
+        encoded = json.dumps(
+            _finite(content), default=_numpy_default, separators=(",", ":")
+        )
+    return encoded.encode()
+
+
+def dumps_orjson(content: Any) -> bytes:
+    return orjson.dumps(
+        content, default=_numpy_default, option=orjson.OPT_SERIALIZE_NUMPY
+    )
+
+
+encode_json = dumps_stdlib if orjson is None else dumps_orjson
+
+
+class NumpyJSONResponse(JSONResponse):
+    """
+    JSON response for calculation results, which are nested lists and dicts of NumPy
+    scalars or arrays. Returning one directly from a route skips jsonable_encoder,
+    which would otherwise walk every value in Python before encoding.
+
+    Encoded with orjson when it is installed, which writes NumPy arrays natively,
+    and with the standard library otherwise.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
+
+class NpzResponse(Response):
+    """
+    Named arrays written as an uncompressed NumPy .npz archive, which clients read
+    with numpy.load without parsing any text.
+    """
+
+    media_type = NPZ
+
+    def render(self, content: Dict[str, np.ndarray]) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, **content)
+        return buffer.getvalue()
@@ -1,3 +1,3 @@
-from diffcalc_API.routes import constraints, hkl, ub
+from diffcalc_API.routes import constraints, hkl, jobs, ub
 
-__all__ = ["ub", "hkl", "constraints"]
+__all__ = ["ub", "hkl", "constraints", "jobs"]
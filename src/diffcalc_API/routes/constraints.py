@@ -2,14 +2,17 @@ from typing import Dict, Union
 
 from fastapi import APIRouter, Body, Depends, Response
 
+from diffcalc_API.conditional import ConditionalRoute, check_etag
 from diffcalc_API.services import constraints as service
-from diffcalc_API.stores.pickling import get_store
+from diffcalc_API.stores.factory import get_store
 from diffcalc_API.stores.protocol import HklCalcStore
 
-router = APIRouter(prefix="/constraints", tags=["constraints"])
+router = APIRouter(
+    prefix="/constraints", tags=["constraints"], route_class=ConditionalRoute
+)
 
 
-@router.get("/{name}")
+@router.get("/{name}", dependencies=[Depends(check_etag)])
 async def get_constraints(name: str, store: HklCalcStore = Depends(get_store)):
     content = await service.get_constraints(name, store)
 
@@ -1,17 +1,44 @@
 from typing import Optional, Tuple, Union
 
-from fastapi import APIRouter, Depends, Query, Response
-
+import numpy as np
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import StreamingResponse
+
+from diffcalc_API.conditional import ConditionalRoute, check_etag
+from diffcalc_API.errors.definitions import DiffcalcAPIException
+from diffcalc_API.examples import hkl as examples
+from diffcalc_API.models.hkl import LabPositionBatchParams, MillerIndicesBatchParams
+from diffcalc_API.responses import NPZ, NpzResponse, NumpyJSONResponse, accepts
 from diffcalc_API.services import hkl as service
-from diffcalc_API.stores.pickling import get_store
+from diffcalc_API.services.live import LiveSession
+from diffcalc_API.services.scans import ScanFormat, lab_position_batch_columns
+from diffcalc_API.stores.factory import get_store
 from diffcalc_API.stores.protocol import HklCalcStore
+from diffcalc_API.streaming import DuplexStreamingResponse
 
-router = APIRouter(prefix="/calculate", tags=["hkl"])
+router = APIRouter(
+    prefix="/calculate",
+    tags=["hkl"],
+    default_response_class=NumpyJSONResponse,
+    route_class=ConditionalRoute,
+)
 
 
 SingleConstraint = Union[Tuple[str, float], str]
 PositionType = Tuple[float, float, float]
 
+NDJSON = "application/x-ndjson"
+
 
 @router.get("/{name}/UB")
 async def calculate_ub(
@@ -24,7 +51,7 @@ async def calculate_ub(
     return Response(content=content, media_type="application/text")
 
 
-@router.get("/{name}/position/lab")
+@router.get("/{name}/position/lab", dependencies=[Depends(check_etag)])
 async def lab_position_from_miller_indices(
     name: str,
     miller_indices: Tuple[float, float, float] = Query(example=[0, 0, 1]),
@@ -35,10 +62,26 @@ async def lab_position_from_miller_indices(
         name, miller_indices, wavelength, store
     )
 
-    return {"payload": positions}
+    return NumpyJSONResponse({"payload": positions})
+
+
+@router.post("/{name}/position/lab/batch")
+async def lab_positions_from_miller_indices_batch(
+    name: str,
+    request: Request,
+    params: LabPositionBatchParams = Body(..., example=examples.lab_position_batch),
+    store: HklCalcStore = Depends(get_store),
+):
+    results = await service.lab_positions_from_miller_indices_batch(
+        name, params.entries, store
+    )
 
+    if accepts(request, NPZ):
+        return NpzResponse(lab_position_batch_columns(params.entries, results))
+    return NumpyJSONResponse({"payload": results})
 
-@router.get("/{name}/position/hkl")
+
+@router.get("/{name}/position/hkl", dependencies=[Depends(check_etag)])
 async def miller_indices_from_lab_position(
     name: str,
     pos: Tuple[float, float, float, float, float, float] = Query(
@@ -48,48 +91,130 @@ async def miller_indices_from_lab_position(
     store: HklCalcStore = Depends(get_store),
 ):
     hkl = await service.miller_indices_from_lab_position(name, pos, wavelength, store)
-    return {"payload": hkl}
+    return NumpyJSONResponse({"payload": hkl})
+
+
+@router.post("/{name}/position/hkl/batch")
+async def miller_indices_from_lab_positions_batch(
+    name: str,
+    request: Request,
+    params: MillerIndicesBatchParams = Body(..., example=examples.miller_indices_batch),
+    store: HklCalcStore = Depends(get_store),
+):
+    hkl = await service.miller_indices_from_lab_positions_batch(
+        name, params.positions, params.wavelength, store
+    )
 
+    if accepts(request, NPZ):
+        return NpzResponse(dict(zip("hkl", np.ascontiguousarray(hkl.T))))
+    return NumpyJSONResponse({"payload": hkl})
 
-@router.get("/{name}/scan/hkl")
+
+@router.post("/{name}/position/hkl/stream")
+async def stream_miller_indices_from_lab_positions(
+    name: str,
+    request: Request,
+    wavelength: float = Query(..., example=1.0),
+    store: HklCalcStore = Depends(get_store),
+):
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    content = await service.stream_miller_indices_from_lab_positions(
+        name, request.stream(), media_type, wavelength, store
+    )
+    return DuplexStreamingResponse(content, media_type=media_type)
+
+
+@router.websocket("/{name}/position/hkl/live")
+async def live_miller_indices_from_lab_positions(
+    websocket: WebSocket,
+    name: str,
+    store: HklCalcStore = Depends(get_store),
+):
+    await websocket.accept()
+    session = LiveSession(name, store)
+    try:
+        await session.refresh()
+    except DiffcalcAPIException as e:
+        await websocket.send_json({"status_code": e.status_code, "message": e.detail})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            await websocket.send_json(await session.reply(message))
+    except WebSocketDisconnect:
+        return
+
+
+@router.get("/{name}/scan/hkl", dependencies=[Depends(check_etag)])
 async def scan_hkl(
     name: str,
+    request: Request,
     start: PositionType = Query(..., example=(1, 0, 1)),
     stop: PositionType = Query(..., example=(2, 0, 2)),
     inc: PositionType = Query(..., example=(0.1, 0, 0.1)),
     wavelength: float = Query(..., example=1),
+    stream: bool = Query(default=False),
+    format: ScanFormat = Query(default=ScanFormat.points),
     store: HklCalcStore = Depends(get_store),
 ):
+    if stream:
+        lines = await service.stream_scan_hkl(name, start, stop, inc, wavelength, store)
+        return StreamingResponse(lines, media_type=NDJSON)
+
     scan_results = await service.scan_hkl(name, start, stop, inc, wavelength, store)
-    return {"payload": scan_results}
+    if accepts(request, NPZ):
+        return NpzResponse(scan_results.columns())
+    return NumpyJSONResponse({"payload": scan_results.render(format)})
 
 
-@router.get("/{name}/scan/wavelength")
+@router.get("/{name}/scan/wavelength", dependencies=[Depends(check_etag)])
 async def scan_wavelength(
     name: str,
+    request: Request,
     start: float = Query(..., example=1.0),
     stop: float = Query(..., example=2.0),
     inc: float = Query(..., example=0.2),
     hkl: PositionType = Query(..., example=(1, 0, 1)),
+    stream: bool = Query(default=False),
+    format: ScanFormat = Query(default=ScanFormat.points),
     store: HklCalcStore = Depends(get_store),
 ):
+    if stream:
+        lines = await service.stream_scan_wavelength(name, start, stop, inc, hkl, store)
+        return StreamingResponse(lines, media_type=NDJSON)
+
     scan_results = await service.scan_wavelength(name, start, stop, inc, hkl, store)
-    return {"payload": scan_results}
+    if accepts(request, NPZ):
+        return NpzResponse(scan_results.columns())
+    return NumpyJSONResponse({"payload": scan_results.render(format)})
 
 
-@router.get("/{name}/scan/{constraint}")
+@router.get("/{name}/scan/{constraint}", dependencies=[Depends(check_etag)])
 async def scan_constraint(
     name: str,
+    request: Request,
     constraint: str,
     start: float = Query(..., example=1),
     stop: float = Query(..., example=4),
     inc: float = Query(..., example=1),
     hkl: PositionType = Query(..., example=(1, 0, 1)),
     wavelength: float = Query(..., example=1.0),
+    stream: bool = Query(default=False),
+    format: ScanFormat = Query(default=ScanFormat.points),
     store: HklCalcStore = Depends(get_store),
 ):
+    if stream:
+        lines = await service.stream_scan_constraint(
+            name, constraint, start, stop, inc, hkl, wavelength, store
+        )
+        return StreamingResponse(lines, media_type=NDJSON)
+
     scan_results = await service.scan_constraint(
         name, constraint, start, stop, inc, hkl, wavelength, store
     )
 
-    return {"payload": scan_results}
+    if accepts(request, NPZ):
+        return NpzResponse(scan_results.columns())
+    return NumpyJSONResponse({"payload": scan_results.render(format)})
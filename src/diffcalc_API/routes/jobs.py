@@ -0,0 +1,52 @@
+from typing import Tuple
+
+from fastapi import APIRouter, Depends, Query, Request
+
+from diffcalc_API.responses import NPZ, NpzResponse, NumpyJSONResponse, accepts
+from diffcalc_API.services import jobs as service
+from diffcalc_API.services.scans import ScanFormat
+from diffcalc_API.stores.factory import get_store
+from diffcalc_API.stores.protocol import HklCalcStore
+
+router = APIRouter(
+    prefix="/jobs", tags=["jobs"], default_response_class=NumpyJSONResponse
+)
+
+PositionType = Tuple[float, float, float]
+
+
+@router.post("/{name}/scan/hkl", status_code=202)
+async def submit_scan_hkl(
+    name: str,
+    start: PositionType = Query(..., example=(1, 0, 1)),
+    stop: PositionType = Query(..., example=(2, 0, 2)),
+    inc: PositionType = Query(..., example=(0.1, 0, 0.1)),
+    wavelength: float = Query(..., example=1),
+    store: HklCalcStore = Depends(get_store),
+):
+    job = await service.submit_scan_hkl(name, start, stop, inc, wavelength, store)
+    return NumpyJSONResponse({"payload": job}, status_code=202)
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str):
+    job = await service.get_job(job_id)
+    return NumpyJSONResponse({"payload": job})
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(
+    job_id: str,
+    request: Request,
+    format: ScanFormat = Query(default=ScanFormat.points),
+):
+    scan_results = await service.get_job_result(job_id)
+    if accepts(request, NPZ):
+        return NpzResponse(scan_results.columns())
+    return NumpyJSONResponse({"payload": scan_results.render(format)})
+
+
+@router.delete("/{job_id}")
+async def cancel_job(job_id: str):
+    job = await service.cancel_job(job_id)
+    return NumpyJSONResponse({"payload": job})
@@ -2,6 +2,7 @@ from typing import Tuple
 
 from fastapi import APIRouter, Body, Depends, Response
 
+from diffcalc_API.conditional import ConditionalRoute, check_etag
 from diffcalc_API.errors.ub import check_params_not_empty, check_property_is_valid
 from diffcalc_API.examples import ub as examples
 from diffcalc_API.models.ub import (
@@ -13,13 +14,13 @@ from diffcalc_API.models.ub import (
     SetLatticeParams,
 )
 from diffcalc_API.services import ub as service
-from diffcalc_API.stores.pickling import get_store
+from diffcalc_API.stores.factory import get_store
 from diffcalc_API.stores.protocol import HklCalcStore
 
-router = APIRouter(prefix="/ub", tags=["ub"])
+router = APIRouter(prefix="/ub", tags=["ub"], route_class=ConditionalRoute)
 
 
-@router.get("/{name}")
+@router.get("/{name}", dependencies=[Depends(check_etag)])
 async def get_ub(name: str, store: HklCalcStore = Depends(get_store)):
     content = await service.get_ub(name, store)
     return Response(content=content, media_type="application/text")
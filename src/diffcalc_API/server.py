@@ -1,19 +1,43 @@
+from dataclasses import asdict
+
 from diffcalc.util import DiffcalcException
-from fastapi import Depends, FastAPI, Request, responses
+from fastapi import Depends, FastAPI, Query, Request, responses
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from diffcalc_API.conditional import NotModified
+from diffcalc_API.config import LIST_PAGE_SIZE, LIST_PAGE_SIZE_MAX
 from diffcalc_API.errors.constraints import responses as constraints_responses
 from diffcalc_API.errors.definitions import DiffcalcAPIException
 from diffcalc_API.errors.hkl import responses as hkl_responses
+from diffcalc_API.errors.jobs import responses as jobs_responses
 from diffcalc_API.errors.ub import responses as ub_responses
-from diffcalc_API.stores.pickling import get_store
+from diffcalc_API.services import events
+from diffcalc_API.services.compute import compute_stats, shutdown_dispatcher
+from diffcalc_API.services.jobs import shutdown_job_queue
+from diffcalc_API.services.memo import close_position_cache
+from diffcalc_API.services.parallel import shutdown_scan_pool
+from diffcalc_API.stores.factory import get_store
+from diffcalc_API.stores.factory import responses as store_responses
+from diffcalc_API.stores.factory import setup_store, teardown_store
 
 from . import routes
 
-app = FastAPI(responses=get_store().responses)
+app = FastAPI(
+    responses=store_responses,
+    on_startup=[setup_store],
+    on_shutdown=[
+        teardown_store,
+        shutdown_scan_pool,
+        shutdown_dispatcher,
+        shutdown_job_queue,
+        close_position_cache,
+    ],
+)
 
 app.include_router(routes.ub.router, responses=ub_responses)
 app.include_router(routes.constraints.router, responses=constraints_responses)
 app.include_router(routes.hkl.router, responses=hkl_responses)
+app.include_router(routes.jobs.router, responses=jobs_responses)
 
 #######################################################################################
 #                              Middleware for Exceptions                              #
@@ -28,6 +52,11 @@ async def diffcalc_exception_handler(request: Request, exc: DiffcalcException):
     )
 
 
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified):
+    return responses.Response(status_code=304, headers={"ETag": exc.etag})
+
+
 @app.exception_handler(DiffcalcAPIException)
 async def http_exception_handler(request: Request, exc: DiffcalcAPIException):
     return responses.JSONResponse(
@@ -36,17 +65,47 @@ async def http_exception_handler(request: Request, exc: DiffcalcAPIException):
     )
 
 
-@app.middleware("http")
-async def server_exceptions_middleware(request: Request, call_next):
-    try:
-        return await call_next(request)
-    except Exception as e:
-        # you probably want some kind of logging here
+class ServerExceptionsMiddleware:
+    """
+    Turns uncaught exceptions into 500 responses.
+
+    Written as plain ASGI rather than with @app.middleware("http"), which reads
+    from receive to watch for disconnects and so breaks endpoints that stream the
+    request body while already streaming their response.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
 
-        return responses.JSONResponse(
-            status_code=500,
-            content={"message": str(e), "type": str(type(e))},
-        )
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            if response_started:
+                raise
+
+            # you probably want some kind of logging here
+
+            response = responses.JSONResponse(
+                status_code=500,
+                content={"message": str(e), "type": str(type(e))},
+            )
+            await response(scope, receive, send)
+
+
+app.add_middleware(ServerExceptionsMiddleware)
 
 
 #######################################################################################
@@ -54,9 +113,50 @@ async def server_exceptions_middleware(request: Request, call_next):
 #######################################################################################
 
 
+@app.get("/")
+async def list_hkl_objects(
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_SIZE_MAX),
+    repo=Depends(get_store),
+):
+    await repo.refresh_index()
+    return {
+        "payload": {
+            "total": len(repo.index),
+            "offset": offset,
+            "crystals": repo.index.page(offset, limit),
+        }
+    }
+
+
+@app.get("/metrics/compute")
+async def compute_metrics():
+    return {"payload": {lane: asdict(stats) for lane, stats in compute_stats().items()}}
+
+
+@app.get("/metrics/store")
+async def store_metrics(repo=Depends(get_store)):
+    return {
+        "payload": {
+            **asdict(repo.cache.stats),
+            "entries": len(repo.cache),
+            "bytes": repo.cache.nbytes,
+        }
+    }
+
+
+@app.get("/{name}/events")
+async def crystal_events(name: str, repo=Depends(get_store)):
+    content = await events.stream_events(name, repo)
+    return responses.StreamingResponse(
+        content, media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
 @app.post("/{name}")
 async def create_hkl_object(name: str, repo=Depends(get_store)):
     await repo.create(name)
+    await events.publish_change(repo, name, "created")
 
     return {"message": f"file for crystal {name} created"}
 
@@ -64,5 +164,6 @@ async def create_hkl_object(name: str, repo=Depends(get_store)):
 @app.delete("/{name}")
 async def delete_hkl_object(name: str, repo=Depends(get_store)):
     await repo.delete(name)
+    await events.publish_change(repo, name, "deleted")
 
     return {"message": f"file for crystal {name} deleted"}
@@ -1,3 +1,31 @@
-from diffcalc_API.services import constraints, hkl, ub
+from diffcalc_API.services import (
+    coalesce,
+    compute,
+    constraints,
+    events,
+    geometry,
+    hkl,
+    jobs,
+    live,
+    memo,
+    parallel,
+    scans,
+    trajectory,
+    ub,
+)
 
-__all__ = ["ub", "hkl", "constraints"]
+__all__ = [
+    "ub",
+    "hkl",
+    "coalesce",
+    "compute",
+    "memo",
+    "constraints",
+    "events",
+    "jobs",
+    "live",
+    "geometry",
+    "parallel",
+    "scans",
+    "trajectory",
+]
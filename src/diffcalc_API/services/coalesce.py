@@ -0,0 +1,86 @@
+"""
+Single-flight coalescing of identical read-only calculations.
+
+Requests for the same calculation on the same crystal state, arriving while one is
+already running, wait for that one instead of loading and solving the crystal again.
+Calculations are keyed on the crystal, its state version in the store, the endpoint
+and its normalised parameters, so a request never joins a calculation started
+before a save it has seen.
+"""
+
+import asyncio
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar, cast
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._flights: WeakKeyDictionary[
+            asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]
+        ] = WeakKeyDictionary()
+        self.coalesced = 0
+
+    def in_flight(self) -> int:
+        flights = self._flights.get(asyncio.get_running_loop(), {})
+        return len(flights)
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Result of func, or of the call already in flight under the same key. The
+        call is shielded, so a caller that gives up does not cancel it for the rest.
+        """
+        flights = self._flights.setdefault(asyncio.get_running_loop(), {})
+
+        task = flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            flights[key] = task
+            task.add_done_callback(lambda _: flights.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+
+_flights = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _flights
+
+
+def normalise(value: Any) -> Hashable:
+    if isinstance(value, (str, bool)) or value is None:
+        return value
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return tuple(normalise(item) for item in value)
+
+
+def single_flight(endpoint: str) -> Callable[[F], F]:
+    """
+    Coalesce calls to a read-only service taking (name, *params, store).
+    """
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        async def wrapper(name: str, *args: Any) -> Any:
+            *params, store = args
+            key = (
+                id(store),
+                name,
+                store.versions.get(name),
+                endpoint,
+                normalise(params),
+            )
+            return await _flights.run(key, lambda: func(name, *args))
+
+        return cast(F, wrapper)
+
+    return decorator
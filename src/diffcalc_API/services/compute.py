@@ -0,0 +1,129 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Tuple, TypeVar
+from weakref import WeakKeyDictionary
+
+from diffcalc_API.config import (
+    COMPUTE_HEAVY_MAX_CONCURRENCY,
+    COMPUTE_HEAVY_WORKERS,
+    COMPUTE_MAX_CONCURRENCY,
+    COMPUTE_WORKERS,
+)
+
+T = TypeVar("T")
+
+
+@dataclass
+class DispatchStats:
+    max_concurrency: int
+    running: int = 0
+    queued: int = 0
+    peak_queued: int = 0
+    completed: int = 0
+    total_wait: float = 0.0  # seconds spent queued, summed over completed calls
+
+
+class ComputeDispatcher:
+    """
+    Runs blocking diffcalc calculations on a bounded thread pool, so that one heavy
+    request does not hold up the event loop for every other client.
+
+    At most max_concurrency calculations run at once; the rest wait in a queue whose
+    depth is reported by stats. Threads share the GIL, so heavy calculations still
+    compete with each other, but the event loop keeps being scheduled between them
+    and light requests are answered promptly.
+    """
+
+    def __init__(
+        self,
+        workers: int = COMPUTE_WORKERS,
+        max_concurrency: int = COMPUTE_MAX_CONCURRENCY,
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="compute"
+        )
+        self._max_concurrency = max_concurrency
+        self._semaphores: WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Semaphore
+        ] = WeakKeyDictionary()
+        self._stats = DispatchStats(max_concurrency)
+
+    @property
+    def stats(self) -> DispatchStats:
+        return replace(self._stats)
+
+    def _semaphore(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        stats = self._stats
+
+        stats.queued += 1
+        stats.peak_queued = max(stats.peak_queued, stats.queued)
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore(loop).acquire()
+        finally:
+            stats.queued -= 1
+
+        stats.running += 1
+        stats.total_wait += time.perf_counter() - queued_at
+
+        # the slot is only freed once the thread is done, even if the request that
+        # queued the calculation was cancelled in the meantime
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self._finished, loop)
+        )
+        return await asyncio.wrap_future(future, loop=loop)
+
+    def _finished(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._stats.running -= 1
+        self._stats.completed += 1
+        self._semaphore(loop).release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Whole scans and batches run in the heavy lane, with threads and a limit of their
+# own, so that single-point calculations never queue behind them.
+LANES: Dict[str, Tuple[int, int]] = {
+    "light": (COMPUTE_WORKERS, COMPUTE_MAX_CONCURRENCY),
+    "heavy": (COMPUTE_HEAVY_WORKERS, COMPUTE_HEAVY_MAX_CONCURRENCY),
+}
+
+_dispatchers: Dict[str, ComputeDispatcher] = {}
+
+
+def get_dispatcher(lane: str = "light") -> ComputeDispatcher:
+    dispatcher = _dispatchers.get(lane)
+    if dispatcher is None:
+        workers, max_concurrency = LANES[lane]
+        dispatcher = _dispatchers[lane] = ComputeDispatcher(workers, max_concurrency)
+    return dispatcher
+
+
+def shutdown_dispatcher() -> None:
+    while _dispatchers:
+        _, dispatcher = _dispatchers.popitem()
+        dispatcher.shutdown()
+
+
+def compute_stats() -> Dict[str, DispatchStats]:
+    return {lane: get_dispatcher(lane).stats for lane in LANES}
+
+
+async def run_compute(func: Callable[..., T], *args: Any) -> T:
+    return await get_dispatcher("light").run(func, *args)
+
+
+async def run_heavy_compute(func: Callable[..., T], *args: Any) -> T:
+    return await get_dispatcher("heavy").run(func, *args)
@@ -0,0 +1,179 @@
+"""
+Server-sent events announcing changes to crystal state.
+
+Services that change a crystal are decorated with publishes_change, which publishes
+a small event naming the change and the crystal's new state version once it has
+been saved. Clients subscribed to GET /{name}/events receive them as they happen,
+instead of polling the crystal for changes.
+
+Events published by other server processes are not seen directly. Instead each
+stream checks the crystal's version in storage every EVENTS_POLL_INTERVAL and sends
+an "external" event when it moved on without an event; the check doubles as a
+keep-alive for proxies.
+"""
+
+import asyncio
+import json
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from threading import Lock
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+from diffcalc_API.conditional import make_etag
+from diffcalc_API.config import EVENTS_POLL_INTERVAL, EVENTS_QUEUE_SIZE
+from diffcalc_API.stores.protocol import HklCalcStore
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+@dataclass
+class StateEvent:
+    crystal: str
+    kind: str
+    version: int
+    etag: Optional[str]  # as sent by the conditional GET routes for this state
+
+
+async def state_event(
+    store: HklCalcStore, name: str, kind: str, version: int
+) -> StateEvent:
+    tag = await store.state_tag(name)
+    return StateEvent(name, kind, version, None if tag is None else make_etag(tag))
+
+
+class Subscription:
+    """
+    Events for one client. If the client falls behind, the oldest events are dropped:
+    the newest one carries the version it needs to catch up.
+    """
+
+    def __init__(self, queue_size: int) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[StateEvent]" = asyncio.Queue(queue_size)
+
+    def deliver(self, event: StateEvent) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def next(self, timeout: float) -> Optional[StateEvent]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventHub:
+    """
+    Fans events out to the subscribers of each crystal. Subscribers may be waiting
+    on other event loops, so events are handed to each on its own loop.
+    """
+
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE) -> None:
+        self._queue_size = queue_size
+        self._lock = Lock()
+        self._subscribers: Dict[Tuple[str, str], Set[Subscription]] = {}
+
+    def subscribers(self, store: HklCalcStore, name: str) -> int:
+        return len(self._subscribers.get((store.versions.epoch, name), ()))
+
+    @contextmanager
+    def subscribe(self, store: HklCalcStore, name: str) -> Iterator[Subscription]:
+        key = (store.versions.epoch, name)
+        subscription = Subscription(self._queue_size)
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._subscribers[key]
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def publish(self, store: HklCalcStore, event: StateEvent) -> None:
+        with self._lock:
+            subscribers = list(
+                self._subscribers.get((store.versions.epoch, event.crystal), ())
+            )
+
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # its loop has closed, and the subscription will never be read again
+                continue
+
+
+_hub = EventHub()
+
+
+def get_event_hub() -> EventHub:
+    return _hub
+
+
+async def publish_change(store: HklCalcStore, name: str, kind: str) -> None:
+    version = store.versions.get(name)
+    _hub.publish(store, await state_event(store, name, kind, version))
+
+
+def publishes_change(func: F) -> F:
+    """
+    Publish an event named after a service taking (name, *params, store) each time
+    it returns.
+    """
+
+    @wraps(func)
+    async def wrapper(name: str, *args: Any) -> Any:
+        result = await func(name, *args)
+        await publish_change(args[-1], name, func.__name__)
+        return result
+
+    return cast(F, wrapper)
+
+
+def format_event(event: StateEvent) -> bytes:
+    return (
+        f"id: {event.version}\nevent: {event.kind}\n"
+        f"data: {json.dumps(asdict(event))}\n\n"
+    ).encode()
+
+
+async def stream_events(
+    name: str, store: HklCalcStore, poll_interval: float = EVENTS_POLL_INTERVAL
+) -> AsyncIterator[bytes]:
+    await store.load(name)
+
+    async def stream() -> AsyncIterator[bytes]:
+        # subscribed before the first event is built, so no change slips in between
+        with _hub.subscribe(store, name) as events:
+            version = await store.current_version(name)
+            yield format_event(await state_event(store, name, "connected", version))
+
+            while True:
+                event = await events.next(poll_interval)
+                if event is None:
+                    current = await store.current_version(name)
+                    if current == version:
+                        yield b": keep-alive\n\n"
+                        continue
+                    event = await state_event(store, name, "external", current)
+
+                version = max(version, event.version)
+                yield format_event(event)
+
+    return stream()
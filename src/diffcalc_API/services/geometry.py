@@ -0,0 +1,79 @@
+"""
+Vectorised versions of the six-circle geometry in diffcalc.hkl.geometry, acting on
+N positions at once. Positions are N x 6 arrays of (mu, delta, nu, eta, chi, phi)
+in degrees, as in Position.
+"""
+
+from functools import lru_cache
+from typing import Tuple, Union
+
+import numpy as np
+from numpy.linalg import inv
+
+
+@lru_cache(maxsize=64)
+def _cached_inverse(matrix: bytes) -> np.ndarray:
+    inverse = inv(np.frombuffer(matrix).reshape(3, 3))
+    inverse.flags.writeable = False
+    return inverse
+
+
+def inverse_ub(ub: np.ndarray) -> np.ndarray:
+    """
+    Inverse of a UB matrix, cached on its value so that repeated batches against an
+    unchanged crystal invert it only once.
+    """
+    return _cached_inverse(np.ascontiguousarray(ub, dtype=float).tobytes())
+
+
+def _rotate(
+    a: np.ndarray, b: np.ndarray, angle: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    c, s = np.cos(angle), np.sin(angle)
+    return c * a - s * b, s * a + c * b
+
+
+def q_phi(positions: np.ndarray) -> np.ndarray:
+    """
+    Unit-wavelength scattering vectors in the phi frame for each position, as N x 3.
+
+    Equivalent to inv(PHI) @ inv(CHI) @ inv(ETA) @ inv(MU) @ (NU @ DELTA - I) @ y,
+    written out component-wise: each inverse is the transposed rotation, so applying
+    it only mixes two components of every vector.
+    """
+    mu, delta, nu, eta, chi, phi = np.radians(positions).T
+
+    # DELTA rotates by -delta about z, NU by nu about x
+    x = np.sin(delta)
+    y = np.cos(nu) * np.cos(delta) - 1
+    z = np.sin(nu) * np.cos(delta)
+
+    y, z = _rotate(y, z, -mu)  # inv(MU), rotation by -mu about x
+    x, y = _rotate(x, y, eta)  # inv(ETA), rotation by eta about z
+    z, x = _rotate(z, x, -chi)  # inv(CHI), rotation by -chi about y
+    x, y = _rotate(x, y, phi)  # inv(PHI), rotation by phi about z
+
+    return np.stack((x, y, z), axis=-1)
+
+
+def miller_indices_from_lab_positions(
+    ub: np.ndarray, positions: np.ndarray, wavelengths: Union[float, np.ndarray]
+) -> np.ndarray:
+    """
+    Same as HklCalculation.get_hkl for every row of positions, returned as N x 3.
+    Wavelengths are either one value for all positions or one per position.
+    """
+    return miller_indices_from_q_phi(
+        inverse_ub(ub), q_phi(np.asarray(positions, dtype=float)), wavelengths
+    )
+
+
+def miller_indices_from_q_phi(
+    inverse: np.ndarray, q: np.ndarray, wavelengths: Union[float, np.ndarray]
+) -> np.ndarray:
+    """
+    Miller indices for unit-wavelength scattering vectors from q_phi, given the
+    inverse of the UB matrix.
+    """
+    k = 2 * np.pi / np.asarray(wavelengths, dtype=float).reshape(-1, 1)
+    return k * q @ inverse.T
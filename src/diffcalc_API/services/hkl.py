@@ -1,19 +1,57 @@
+from copy import deepcopy
 from itertools import product
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import numpy as np
+from diffcalc.hkl.calc import HklCalculation
 from diffcalc.hkl.geometry import Position
+from diffcalc.util import DiffcalcException
 
+from diffcalc_API.config import (
+    BATCH_MAX_POSITIONS,
+    SCAN_PARALLEL_MIN_POINTS,
+    SCAN_PROCESSES,
+)
+from diffcalc_API.errors.definitions import DiffcalcAPIException
 from diffcalc_API.errors.hkl import (
     calculate_ub_matrix,
+    check_batch_size,
+    check_trajectory_format,
+    check_ub_calculated,
     check_valid_miller_indices,
     check_valid_scan_bounds,
+    check_valid_wavelengths,
 )
+from diffcalc_API.models.hkl import MillerIndicesParams
+from diffcalc_API.responses import encode_json
+from diffcalc_API.services.coalesce import single_flight
+from diffcalc_API.services.compute import run_compute, run_heavy_compute
+from diffcalc_API.services.events import publishes_change
+from diffcalc_API.services.geometry import miller_indices_from_lab_positions
+from diffcalc_API.services.memo import get_position_cache
+from diffcalc_API.services.parallel import (
+    Solutions,
+    iter_parallel_solutions,
+    solve_in_parallel,
+)
+from diffcalc_API.services.scans import ScanResult
+from diffcalc_API.services.trajectory import TRAJECTORY_FORMATS, convert_trajectory
 from diffcalc_API.stores.protocol import HklCalcStore
 
 PositionType = Tuple[float, float, float]
 
 
+@single_flight("position/lab")
 async def lab_position_from_miller_indices(
     name: str,
     miller_indices: Tuple[float, float, float],
@@ -23,11 +61,53 @@ async def lab_position_from_miller_indices(
     hklcalc = await store.load(name)
 
     check_valid_miller_indices(miller_indices)
-    all_positions = hklcalc.get_position(*miller_indices, wavelength)
+    return await run_compute(solve_point, hklcalc, miller_indices, wavelength)
+
 
-    return combine_lab_position_results(all_positions)
+async def lab_positions_from_miller_indices_batch(
+    name: str,
+    entries: List[MillerIndicesParams],
+    store: HklCalcStore,
+) -> List[Dict[str, Any]]:
+    check_batch_size(len(entries))
+    hklcalc = await store.load(name)
 
+    return await run_heavy_compute(lab_position_batch_entries, hklcalc, entries)
+
+
+def lab_position_batch_entries(
+    hklcalc: HklCalculation, entries: List[MillerIndicesParams]
+) -> List[Dict[str, Any]]:
+    with get_position_cache().batch():
+        return [
+            lab_position_batch_entry(hklcalc, entry.miller_indices, entry.wavelength)
+            for entry in entries
+        ]
+
+
+def lab_position_batch_entry(
+    hklcalc: HklCalculation,
+    miller_indices: Tuple[float, float, float],
+    wavelength: float,
+) -> Dict[str, Any]:
+    """
+    Errors are reported in the entry, in the shape the server would have responded
+    with for a single request, so that one bad entry does not fail the whole batch.
+    """
+    try:
+        check_valid_miller_indices(miller_indices)
+        solutions = solve_point(hklcalc, miller_indices, wavelength)
+    except DiffcalcAPIException as e:
+        return {"status_code": e.status_code, "message": e.detail, "type": str(type(e))}
+    except DiffcalcException as e:
+        return {"status_code": 400, "message": str(e), "type": str(type(e))}
+    except Exception as e:
+        return {"status_code": 500, "message": str(e), "type": str(type(e))}
 
+    return {"status_code": 200, "payload": solutions}
+
+
+@single_flight("position/hkl")
 async def miller_indices_from_lab_position(
     name: str,
     pos: Tuple[float, float, float, float, float, float],
@@ -35,10 +115,51 @@ async def miller_indices_from_lab_position(
     store: HklCalcStore,
 ) -> Tuple[Any, ...]:
     hklcalc = await store.load(name)
-    position = hklcalc.get_hkl(Position(*pos), wavelength)
+    position = await run_compute(hklcalc.get_hkl, Position(*pos), wavelength)
     return tuple(np.round(position, 16))
 
 
+async def miller_indices_from_lab_positions_batch(
+    name: str,
+    positions: Sequence[Sequence[float]],
+    wavelength: Union[float, Sequence[float]],
+    store: HklCalcStore,
+) -> np.ndarray:
+    check_batch_size(len(positions), BATCH_MAX_POSITIONS)
+    wavelengths = np.asarray(wavelength, dtype=float)
+    check_valid_wavelengths(wavelengths, len(positions))
+
+    hklcalc = await store.load(name)
+    check_ub_calculated(hklcalc)
+
+    positions_array = np.asarray(positions, dtype=float).reshape(-1, 6)
+    hkl = await run_heavy_compute(
+        miller_indices_from_lab_positions,
+        hklcalc.ubcalc.UB,
+        positions_array,
+        wavelengths,
+    )
+    return np.round(hkl, 16)
+
+
+async def stream_miller_indices_from_lab_positions(
+    name: str,
+    chunks: AsyncIterable[bytes],
+    media_type: str,
+    wavelength: float,
+    store: HklCalcStore,
+) -> AsyncIterator[bytes]:
+    check_trajectory_format(media_type, TRAJECTORY_FORMATS)
+    check_valid_wavelengths(np.asarray(wavelength, dtype=float), 1)
+
+    hklcalc = await store.load(name)
+    check_ub_calculated(hklcalc)
+
+    trajectory = TRAJECTORY_FORMATS[media_type]()
+    return convert_trajectory(hklcalc.ubcalc.UB, chunks, trajectory, wavelength)
+
+
+@single_flight("scan/hkl")
 async def scan_hkl(
     name: str,
     start: PositionType,
@@ -46,23 +167,78 @@ async def scan_hkl(
     inc: PositionType,
     wavelength: float,
     store: HklCalcStore,
-) -> Dict[str, List[Dict[str, float]]]:
+) -> ScanResult:
+    hklcalc = await store.load(name)
+    points = scan_hkl_points(start, stop, inc)
+
+    if use_scan_pool(points):
+        solutions = await solve_in_parallel(hklcalc, points, wavelength)
+    else:
+        solutions = await run_heavy_compute(solve_points, hklcalc, points, wavelength)
+
+    return hkl_scan_result(points, solutions)
+
+
+async def stream_scan_hkl(
+    name: str,
+    start: PositionType,
+    stop: PositionType,
+    inc: PositionType,
+    wavelength: float,
+    store: HklCalcStore,
+) -> AsyncIterator[bytes]:
     hklcalc = await store.load(name)
+    points = scan_hkl_points(start, stop, inc)
+
+    return scan_lines(iter_scan_hkl(hklcalc, points, wavelength))
+
+
+async def iter_scan_hkl(
+    hklcalc: HklCalculation, points: List[PositionType], wavelength: float
+) -> AsyncIterator[Tuple[Any, Solutions]]:
+    if use_scan_pool(points):
+        solved = 0
+        async for chunk in iter_parallel_solutions(hklcalc, points, wavelength):
+            for solutions in chunk:
+                yield list(points[solved]), solutions
+                solved += 1
+    else:
+        for point in points:
+            yield list(point), await run_compute(
+                solve_point, hklcalc, point, wavelength
+            )
+
+
+def scan_hkl_points(
+    start: PositionType, stop: PositionType, inc: PositionType
+) -> List[PositionType]:
     axes_values = [
         generate_axis(start[i], stop[i], inc[i]) if inc[i] != 0 else [0]
         for i in range(3)
     ]
 
-    results = {}
+    points = list(product(*axes_values))
+    for point in points:
+        check_valid_miller_indices(point)
+
+    return points
+
+
+def hkl_scan_result(
+    points: Sequence[PositionType], solutions: Sequence[Solutions]
+) -> ScanResult:
+    return ScanResult(
+        dict(zip("hkl", np.array(points, dtype=float).reshape(-1, 3).T)),
+        [f"({h}, {k}, {l})" for h, k, l in points],
+        solutions,
+    )
 
-    for h, k, l in product(*axes_values):
-        check_valid_miller_indices((h, k, l))
-        all_positions = hklcalc.get_position(h, k, l, wavelength)
-        results[f"({h}, {k}, {l})"] = combine_lab_position_results(all_positions)
 
-    return results
+def use_scan_pool(points: Sequence[PositionType]) -> bool:
+    return SCAN_PROCESSES > 0 and len(points) >= SCAN_PARALLEL_MIN_POINTS
 
 
+@single_flight("scan/wavelength")
 async def scan_wavelength(
     name: str,
     start: float,
@@ -70,19 +246,47 @@ async def scan_wavelength(
     inc: float,
     hkl: PositionType,
     store: HklCalcStore,
-) -> Dict[str, List[Dict[str, float]]]:
+) -> ScanResult:
     hklcalc = await store.load(name)
     check_valid_scan_bounds(start, stop, inc)
     wavelengths = np.arange(start, stop + inc, inc)
-    result = {}
 
-    for wavelength in wavelengths:
-        all_positions = hklcalc.get_position(*hkl, wavelength)
-        result[f"{wavelength}"] = combine_lab_position_results(all_positions)
+    return ScanResult(
+        {"wavelength": wavelengths},
+        [f"{wavelength}" for wavelength in wavelengths],
+        await run_heavy_compute(solve_wavelengths, hklcalc, hkl, wavelengths),
+    )
 
-    return result
+
+async def stream_scan_wavelength(
+    name: str,
+    start: float,
+    stop: float,
+    inc: float,
+    hkl: PositionType,
+    store: HklCalcStore,
+) -> AsyncIterator[bytes]:
+    hklcalc = await store.load(name)
+    check_valid_scan_bounds(start, stop, inc)
+    wavelengths = np.arange(start, stop + inc, inc)
+
+    async def iter_scan() -> AsyncIterator[Tuple[Any, Solutions]]:
+        for wavelength in wavelengths:
+            yield float(wavelength), await run_compute(
+                solve_point, hklcalc, hkl, wavelength
+            )
+
+    return scan_lines(iter_scan())
 
 
+def solve_wavelengths(
+    hklcalc: HklCalculation, hkl: PositionType, wavelengths: np.ndarray
+) -> List[Solutions]:
+    with get_position_cache().batch():
+        return [solve_point(hklcalc, hkl, wavelength) for wavelength in wavelengths]
+
+
+@single_flight("scan/constraint")
 async def scan_constraint(
     name: str,
     constraint: str,
@@ -92,43 +296,120 @@ async def scan_constraint(
     hkl: PositionType,
     wavelength: float,
     store: HklCalcStore,
-) -> Dict[str, List[Dict[str, float]]]:
-    hklcalc = await store.load(name)
+) -> ScanResult:
+    # the scan changes the constraint, so it runs on a copy of the shared crystal
+    hklcalc = deepcopy(await store.load(name))
     check_valid_scan_bounds(start, stop, inc)
-    result = {}
-    for value in np.arange(start, stop + inc, inc):
-        setattr(hklcalc, constraint, value)
-        all_positions = hklcalc.get_position(*hkl, wavelength)
-        result[f"{value}"] = combine_lab_position_results(all_positions)
+    values = np.arange(start, stop + inc, inc)
 
-    return result
+    return ScanResult(
+        {constraint: values},
+        [f"{value}" for value in values],
+        await run_heavy_compute(
+            solve_constraint_values, hklcalc, constraint, values, hkl, wavelength
+        ),
+    )
 
 
-def generate_axis(start: float, stop: float, inc: float):
+async def stream_scan_constraint(
+    name: str,
+    constraint: str,
+    start: float,
+    stop: float,
+    inc: float,
+    hkl: PositionType,
+    wavelength: float,
+    store: HklCalcStore,
+) -> AsyncIterator[bytes]:
+    # the scan changes the constraint, so it runs on a copy of the shared crystal
+    hklcalc = deepcopy(await store.load(name))
     check_valid_scan_bounds(start, stop, inc)
-    return np.arange(start, stop + inc, inc)
+    values = np.arange(start, stop + inc, inc)
 
+    async def iter_scan() -> AsyncIterator[Tuple[Any, Solutions]]:
+        for value in values:
+            yield float(value), await run_compute(
+                solve_constraint_value, hklcalc, constraint, value, hkl, wavelength
+            )
 
-def combine_lab_position_results(
-    positions: List[Tuple[Position, Dict[str, float]]]
-) -> List[Dict[str, float]]:
-    result = []
+    return scan_lines(iter_scan())
+
+
+def solve_constraint_values(
+    hklcalc: HklCalculation,
+    constraint: str,
+    values: np.ndarray,
+    hkl: PositionType,
+    wavelength: float,
+) -> List[Solutions]:
+    with get_position_cache().batch():
+        return [
+            solve_constraint_value(hklcalc, constraint, value, hkl, wavelength)
+            for value in values
+        ]
+
+
+def solve_constraint_value(
+    hklcalc: HklCalculation,
+    constraint: str,
+    value: float,
+    hkl: PositionType,
+    wavelength: float,
+) -> Solutions:
+    setattr(hklcalc, constraint, value)
+    return solve_point(hklcalc, hkl, wavelength)
 
-    for position in positions:
-        result.append({**position[0].asdict, **position[1]})
 
-    return result
+def solve_point(
+    hklcalc: HklCalculation, hkl: PositionType, wavelength: float
+) -> Solutions:
+    return get_position_cache().get_position(hklcalc, hkl, wavelength)
 
 
+def solve_points(
+    hklcalc: HklCalculation, points: Sequence[PositionType], wavelength: float
+) -> List[Solutions]:
+    with get_position_cache().batch():
+        return [solve_point(hklcalc, point, wavelength) for point in points]
+
+
+async def scan_lines(
+    results: AsyncIterator[Tuple[Any, Solutions]]
+) -> AsyncIterator[bytes]:
+    """
+    One NDJSON line per scan point, written as soon as the point is solved. The
+    status code has been sent by the time a point fails, so a failure ends the
+    stream with a line in the shape of the server's error responses instead.
+    """
+    try:
+        async for point, solutions in results:
+            yield encode_json({"point": point, "payload": solutions}) + b"\n"
+    except DiffcalcAPIException as e:
+        yield scan_error_line(e.detail, e)
+    except Exception as e:
+        yield scan_error_line(str(e), e)
+
+
+def scan_error_line(message: str, error: Exception) -> bytes:
+    return encode_json({"message": message, "type": str(type(error))}) + b"\n"
+
+
+def generate_axis(start: float, stop: float, inc: float):
+    check_valid_scan_bounds(start, stop, inc)
+    return np.arange(start, stop + inc, inc)
+
+
+@publishes_change
 async def calculate_ub(
     name: str,
     first_tag: Optional[Union[int, str]],
     second_tag: Optional[Union[int, str]],
     store: HklCalcStore,
 ) -> str:
-    hklcalc = await store.load(name)
+    async with store.lock(name):
+        hklcalc = await store.load_for_update(name)
 
-    calculate_ub_matrix(hklcalc, first_tag, second_tag)
+        await run_compute(calculate_ub_matrix, hklcalc, first_tag, second_tag)
 
-    await store.save(name, hklcalc)
-    return str(np.round(hklcalc.ubcalc.UB, 6))
+        await store.save(name, hklcalc)
+        return str(np.round(hklcalc.ubcalc.UB, 6))
@@ -0,0 +1,304 @@
+"""
+Long-running hkl scans as jobs.
+
+Submitting a scan validates it and takes a snapshot of the crystal straight away,
+then queues the scan and returns its job id, so large scans hold no connection open
+while they are solved. Clients poll the job for progress, cancel it, or fetch its
+results once it has finished.
+
+Jobs run on threads of their own, which solve a chunk of points at a time on a
+process pool kept apart from the one serving requests. Between chunks a job
+records its progress and stops if it was cancelled. At most JOBS_MAX_RUNNING jobs
+run at once, and at most JOBS_MAX_RUNNING_PER_CRYSTAL for any one crystal; the rest
+wait in the order they were submitted. Jobs that have ended, with their results,
+are forgotten JOBS_RESULT_TTL seconds later.
+"""
+
+import multiprocessing
+import pickle
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from threading import Lock
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from diffcalc_API.config import (
+    JOBS_CHUNK_POINTS,
+    JOBS_MAX_RUNNING,
+    JOBS_MAX_RUNNING_PER_CRYSTAL,
+    JOBS_PROCESSES,
+    JOBS_RESULT_TTL,
+)
+from diffcalc_API.errors.definitions import DiffcalcAPIException
+from diffcalc_API.errors.jobs import check_job_exists, check_job_finished
+from diffcalc_API.services.compute import run_heavy_compute
+from diffcalc_API.services.hkl import PositionType, hkl_scan_result, scan_hkl_points
+from diffcalc_API.services.parallel import (
+    Solutions,
+    crystal_payload,
+    solve_chunk,
+    solve_crystal_points,
+)
+from diffcalc_API.services.scans import ScanResult
+from diffcalc_API.stores.protocol import HklCalcStore
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    finished = "finished"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+@dataclass
+class Job:
+    id: str
+    crystal: str
+    version: int  # state version of the crystal the job was submitted against
+    total: int
+    done: int = 0
+    status: JobStatus = JobStatus.queued
+    submitted: float = field(default_factory=time.time)
+    ended: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[ScanResult] = field(default=None, repr=False)
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "crystal": self.crystal,
+            "version": self.version,
+            "status": self.status.value,
+            "done": self.done,
+            "total": self.total,
+            "submitted": self.submitted,
+            "ended": self.ended,
+            "error": self.error,
+        }
+
+
+Work = Callable[[Job], ScanResult]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Queues jobs and runs them within the limits on running jobs. Thread-safe, and
+    independent of any event loop, so jobs outlive the requests that submit them.
+    """
+
+    def __init__(
+        self,
+        max_running: int = JOBS_MAX_RUNNING,
+        max_running_per_crystal: int = JOBS_MAX_RUNNING_PER_CRYSTAL,
+        processes: int = JOBS_PROCESSES,
+        chunk_points: int = JOBS_CHUNK_POINTS,
+        result_ttl: float = JOBS_RESULT_TTL,
+    ) -> None:
+        self._max_running = max_running
+        self._max_running_per_crystal = max_running_per_crystal
+        self._chunk_points = chunk_points
+        self._result_ttl = result_ttl
+
+        self._threads = ThreadPoolExecutor(
+            max_workers=max_running, thread_name_prefix="job"
+        )
+        # spawned rather than forked, as the server process runs threads
+        self._pool = (
+            ProcessPoolExecutor(
+                max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+            )
+            if processes > 0
+            else None
+        )
+
+        self._lock = Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._queued: Deque[Tuple[Job, Work]] = deque()
+        self._running: "Counter[str]" = Counter()
+
+    def submit(self, crystal: str, version: int, total: int, work: Work) -> Job:
+        job = Job(uuid.uuid4().hex, crystal, version, total)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+            self._queued.append((job, work))
+            self._schedule()
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            self._expire()
+            check_job_exists(job_id, self._jobs)
+            return self._jobs[job_id]
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        Cancel a job that has not ended yet. A running job stops before its next
+        chunk of points.
+        """
+        with self._lock:
+            self._expire()
+            check_job_exists(job_id, self._jobs)
+            job = self._jobs[job_id]
+
+            if job.status == JobStatus.queued:
+                self._queued = deque(
+                    (queued, work) for queued, work in self._queued if queued is not job
+                )
+                job.ended = time.time()
+            if job.status in (JobStatus.queued, JobStatus.running):
+                job.status = JobStatus.cancelled
+            return job
+
+    def solve(
+        self,
+        job: Job,
+        crystal: Tuple[str, bytes],
+        points: Sequence[PositionType],
+        wavelength: float,
+    ) -> List[Solutions]:
+        """
+        Solutions for every point, a chunk at a time, for use by a job's work.
+        """
+        digest, data = crystal
+        hklcalc = pickle.loads(data) if self._pool is None else None
+
+        solutions: List[Solutions] = []
+        for start in range(0, len(points), self._chunk_points):
+            if job.status == JobStatus.cancelled:
+                raise JobCancelled()
+
+            chunk = points[start : start + self._chunk_points]
+            if hklcalc is None:
+                assert self._pool is not None
+                future = self._pool.submit(solve_chunk, digest, data, chunk, wavelength)
+                solutions.extend(future.result())
+            else:
+                solutions.extend(solve_crystal_points(hklcalc, chunk, wavelength))
+            job.done = len(solutions)
+
+        return solutions
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for job, _ in self._queued:
+                job.status = JobStatus.cancelled
+            self._queued.clear()
+            for job in self._jobs.values():
+                if job.status == JobStatus.running:
+                    job.status = JobStatus.cancelled
+
+        self._threads.shutdown(wait=True, cancel_futures=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _schedule(self) -> None:
+        # called with the lock held
+        for entry in list(self._queued):
+            if sum(self._running.values()) >= self._max_running:
+                return
+
+            job, work = entry
+            if self._running[job.crystal] >= self._max_running_per_crystal:
+                continue
+
+            self._queued.remove(entry)
+            self._running[job.crystal] += 1
+            job.status = JobStatus.running
+            self._threads.submit(self._run, job, work)
+
+    def _run(self, job: Job, work: Work) -> None:
+        result: Optional[ScanResult] = None
+        error: Optional[str] = None
+        try:
+            result = work(job)
+        except JobCancelled:
+            pass
+        except DiffcalcAPIException as e:
+            error = e.detail
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            if job.status == JobStatus.running:
+                job.status = JobStatus.failed if result is None else JobStatus.finished
+                job.result = result
+                job.error = error
+            job.ended = time.time()
+
+            self._running[job.crystal] -= 1
+            if not self._running[job.crystal]:
+                del self._running[job.crystal]
+            self._schedule()
+
+    def _expire(self) -> None:
+        # called with the lock held
+        now = time.time()
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.ended is not None and now - job.ended >= self._result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
+
+
+def shutdown_job_queue() -> None:
+    global _queue
+    if _queue is not None:
+        _queue.shutdown()
+        _queue = None
+
+
+async def submit_scan_hkl(
+    name: str,
+    start: PositionType,
+    stop: PositionType,
+    inc: PositionType,
+    wavelength: float,
+    store: HklCalcStore,
+) -> Dict[str, Any]:
+    hklcalc = await store.load(name)
+    version = await store.current_version(name)
+    points = scan_hkl_points(start, stop, inc)
+    crystal = await run_heavy_compute(crystal_payload, hklcalc)
+    queue = get_job_queue()
+
+    def work(job: Job) -> ScanResult:
+        return hkl_scan_result(points, queue.solve(job, crystal, points, wavelength))
+
+    return queue.submit(name, version, len(points), work).progress()
+
+
+async def get_job(job_id: str) -> Dict[str, Any]:
+    return get_job_queue().get(job_id).progress()
+
+
+async def get_job_result(job_id: str) -> ScanResult:
+    job = get_job_queue().get(job_id)
+    check_job_finished(job_id, job.status.value)
+
+    assert job.result is not None
+    return job.result
+
+
+async def cancel_job(job_id: str) -> Dict[str, Any]:
+    return get_job_queue().cancel(job_id).progress()
@@ -0,0 +1,85 @@
+"""
+Live conversion of motor positions to hkl over a WebSocket.
+
+A LiveSession keeps the crystal's UB matrix and its inverse for as long as the
+client stays connected, so each position costs one state version check and a few
+vector operations rather than a store load. The crystal is loaded again only when
+its state version moves on, which covers changes made through other connections
+and, via the storage token, other server processes.
+"""
+
+import json
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+from pydantic import ValidationError
+
+from diffcalc_API.errors.definitions import DiffcalcAPIException
+from diffcalc_API.errors.hkl import check_ub_calculated, check_valid_wavelengths
+from diffcalc_API.models.hkl import LivePositionParams
+from diffcalc_API.services.geometry import inverse_ub, miller_indices_from_q_phi, q_phi
+from diffcalc_API.stores.protocol import HklCalcStore
+
+
+class LiveSession:
+    def __init__(self, name: str, store: HklCalcStore) -> None:
+        self.name = name
+        self.store = store
+        self.version: Optional[int] = None
+        self._hklcalc: Optional[HklCalculation] = None
+        self._inverse: Optional[np.ndarray] = None
+
+    async def refresh(self) -> None:
+        version = await self.store.current_version(self.name)
+        if version == self.version:
+            return
+
+        hklcalc = await self.store.load(self.name)
+        ub = hklcalc.ubcalc.UB
+
+        self._hklcalc = hklcalc
+        self._inverse = None if ub is None else inverse_ub(ub)
+        self.version = version
+
+    async def miller_indices(
+        self, pos: np.ndarray, wavelength: float
+    ) -> Tuple[Any, ...]:
+        await self.refresh()
+        assert self._hklcalc is not None
+        check_ub_calculated(self._hklcalc)
+        assert self._inverse is not None
+        check_valid_wavelengths(np.asarray(wavelength, dtype=float), 1)
+
+        hkl = miller_indices_from_q_phi(
+            self._inverse, q_phi(pos.reshape(1, 6)), wavelength
+        )
+        return tuple(np.round(hkl[0], 16))
+
+    async def reply(self, message: str) -> Dict[str, Any]:
+        """
+        Answer one position message. Errors are reported in the reply, in the same
+        shape as the entries of the batch endpoints, and leave the session open.
+        """
+        try:
+            params = LivePositionParams.parse_obj(json.loads(message))
+        except (ValueError, ValidationError) as e:
+            return {"status_code": 422, "message": str(e), "type": str(type(e))}
+
+        reply: Dict[str, Any] = {} if params.id is None else {"id": params.id}
+        try:
+            hkl = await self.miller_indices(
+                np.asarray(params.pos, dtype=float), params.wavelength
+            )
+        except DiffcalcAPIException as e:
+            reply.update(
+                {
+                    "status_code": e.status_code,
+                    "message": e.detail,
+                    "type": str(type(e)),
+                }
+            )
+            return reply
+
+        reply.update({"status_code": 200, "payload": hkl, "version": self.version})
+        return reply
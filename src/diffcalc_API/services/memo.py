@@ -0,0 +1,193 @@
+"""
+Memoised get_position results.
+
+Results are keyed on a fingerprint of everything get_position reads from the
+crystal (UB, the lattice's B matrix, constraints and reference vectors) together
+with the Miller indices and wavelength. The fingerprint is taken from the crystal
+as loaded, so any change saved by the ub or constraints services gives new keys
+without the cache being told, and stale entries simply age out.
+
+Recent results are kept in memory. If POSITION_CACHE_DATABASE is set, every result
+is also written to an SQLite file, so results survive restarts of the server. Scans
+solve their points inside PositionCache.batch, which writes all their new results
+in one transaction instead of one per point.
+
+Scans solved on the process pool of services.parallel, and scan jobs, bypass the
+cache: their points are solved in worker processes, which have none.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+
+from diffcalc_API.config import (
+    POSITION_CACHE_DATABASE,
+    POSITION_CACHE_DISK_ENTRIES,
+    POSITION_CACHE_ENTRIES,
+    VECTOR_PROPERTIES,
+)
+from diffcalc_API.services.parallel import Solutions, combine_lab_position_results
+
+
+def crystal_fingerprint(hklcalc: HklCalculation) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    crystal = hklcalc.ubcalc.crystal
+    for value in [hklcalc.ubcalc.UB, None if crystal is None else crystal.B] + [
+        getattr(hklcalc.ubcalc, vector) for vector in VECTOR_PROPERTIES
+    ]:
+        digest.update(b"-" if value is None else np.asarray(value, float).tobytes())
+    digest.update(repr(sorted(hklcalc.constraints.asdict.items())).encode())
+    return digest.hexdigest()
+
+
+class DiskTier:
+    def __init__(self, database: Path, max_entries: int) -> None:
+        database.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(database), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS positions (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._connection.commit()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Solutions]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM positions WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_many(self, items: List[Tuple[str, Solutions]]) -> None:
+        if not items:
+            return
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO positions (key, value) VALUES (?, ?)",
+                [(key, json.dumps(solutions)) for key, solutions in items],
+            )
+            # rows are dropped oldest first once the table is full
+            (last,) = self._connection.execute(
+                "SELECT MAX(rowid) FROM positions"
+            ).fetchone()
+            self._connection.execute(
+                "DELETE FROM positions WHERE rowid <= ?",
+                ((last or 0) - self._max_entries,),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class PositionCache:
+    def __init__(
+        self,
+        max_entries: int = POSITION_CACHE_ENTRIES,
+        database: Optional[Path] = None,
+        disk_entries: int = POSITION_CACHE_DISK_ENTRIES,
+    ) -> None:
+        self._entries: "OrderedDict[str, Solutions]" = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._disk = None if database is None else DiskTier(database, disk_entries)
+        self._batches = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Hold the disk writes of results solved by this thread, and write them in one
+        transaction on leaving. Nested batches are part of the outermost one.
+        """
+        if getattr(self._batches, "pending", None) is not None:
+            yield
+            return
+
+        pending: List[Tuple[str, Solutions]] = []
+        self._batches.pending = pending
+        try:
+            yield
+        finally:
+            self._batches.pending = None
+            if self._disk is not None:
+                self._disk.put_many(pending)
+
+    def get_position(
+        self, hklcalc: HklCalculation, hkl: Sequence[float], wavelength: float
+    ) -> Solutions:
+        """
+        Same as combining the results of hklcalc.get_position, solving only on a
+        miss. Errors are raised as they would be and are never cached.
+        """
+        numbers = ",".join(repr(float(value)) for value in (*hkl, wavelength))
+        key = f"{crystal_fingerprint(hklcalc)}:{numbers}"
+
+        with self._lock:
+            solutions = self._entries.get(key)
+            if solutions is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return solutions
+
+        if self._disk is not None:
+            solutions = self._disk.get(key)
+        if solutions is None:
+            solutions = combine_lab_position_results(
+                hklcalc.get_position(*hkl, wavelength)
+            )
+            if self._disk is not None:
+                pending = getattr(self._batches, "pending", None)
+                if pending is None:
+                    self._disk.put_many([(key, solutions)])
+                else:
+                    pending.append((key, solutions))
+            solved = True
+        else:
+            solved = False
+
+        with self._lock:
+            if solved:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._entries[key] = solutions
+            if len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+        return solutions
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+
+
+_cache: Optional[PositionCache] = None
+
+
+def get_position_cache() -> PositionCache:
+    global _cache
+    if _cache is None:
+        database = Path(POSITION_CACHE_DATABASE) if POSITION_CACHE_DATABASE else None
+        _cache = PositionCache(database=database)
+    return _cache
+
+
+def close_position_cache() -> None:
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
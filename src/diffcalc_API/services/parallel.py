@@ -0,0 +1,160 @@
+"""
+Solve large hkl scans on a pool of worker processes.
+
+The crystal is pickled once per scan, on the heavy compute lane, and sent with each
+chunk of points under its digest. Workers keep the last few crystals they unpickled,
+so each worker decodes a crystal once however many chunks of the scan it solves.
+
+Solving the chunks is not counted against the heavy lane's concurrency limit. The
+pool's SCAN_PROCESSES workers bound how many chunks are solved at once across all
+scans, and each scan keeps only a bounded window of chunks in flight, so concurrent
+pool scans queue in the pool rather than holding threads of the lane.
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import pickle
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.geometry import Position
+
+from diffcalc_API.config import SCAN_CHUNK_POINTS, SCAN_PROCESSES
+from diffcalc_API.services.compute import run_heavy_compute
+
+Point = Tuple[float, float, float]
+Solutions = List[Dict[str, float]]
+
+WORKER_CACHED_CRYSTALS = 4
+
+_pool: Optional[ProcessPoolExecutor] = None
+_worker_crystals: "OrderedDict[str, HklCalculation]" = OrderedDict()
+
+
+def get_scan_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawned rather than forked, as the server process runs threads
+        _pool = ProcessPoolExecutor(
+            max_workers=SCAN_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_scan_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def combine_lab_position_results(
+    positions: List[Tuple[Position, Dict[str, float]]]
+) -> Solutions:
+    return [{**position.asdict, **virtual} for position, virtual in positions]
+
+
+def _worker_crystal(digest: str, data: bytes) -> HklCalculation:
+    hklcalc = _worker_crystals.get(digest)
+    if hklcalc is None:
+        hklcalc = pickle.loads(data)
+        _worker_crystals[digest] = hklcalc
+        if len(_worker_crystals) > WORKER_CACHED_CRYSTALS:
+            _worker_crystals.popitem(last=False)
+    else:
+        _worker_crystals.move_to_end(digest)
+
+    return hklcalc
+
+
+def crystal_payload(hklcalc: HklCalculation) -> Tuple[str, bytes]:
+    """
+    The crystal pickled for the workers, under the digest they cache it by.
+    """
+    data = pickle.dumps(hklcalc)
+    return hashlib.blake2b(data, digest_size=16).hexdigest(), data
+
+
+def solve_chunk(
+    digest: str, data: bytes, points: Sequence[Point], wavelength: float
+) -> List[Solutions]:
+    return solve_crystal_points(_worker_crystal(digest, data), points, wavelength)
+
+
+def solve_crystal_points(
+    hklcalc: HklCalculation, points: Sequence[Point], wavelength: float
+) -> List[Solutions]:
+    return [
+        combine_lab_position_results(hklcalc.get_position(*point, wavelength))
+        for point in points
+    ]
+
+
+async def iter_parallel_solutions(
+    hklcalc: HklCalculation,
+    points: Sequence[Point],
+    wavelength: float,
+    chunk_points: Optional[int] = None,
+) -> AsyncIterator[List[Solutions]]:
+    """
+    Solutions for every point, a chunk at a time and in the order of points. At most
+    2 * SCAN_PROCESSES chunks are in flight at once, and the next is only submitted
+    as a solved one is taken, so a slow consumer never leaves the whole scan waiting
+    in memory. Chunks in flight are cancelled if iteration stops early.
+    """
+    chunk_points = chunk_points or SCAN_CHUNK_POINTS
+    digest, data = await run_heavy_compute(crystal_payload, hklcalc)
+
+    loop = asyncio.get_running_loop()
+    pool = get_scan_pool()
+    starts = iter(range(0, len(points), chunk_points))
+    in_flight: "Deque[asyncio.Future[List[Solutions]]]" = deque()
+
+    def submit_next() -> None:
+        start = next(starts, None)
+        if start is not None:
+            in_flight.append(
+                loop.run_in_executor(
+                    pool,
+                    solve_chunk,
+                    digest,
+                    data,
+                    points[start : start + chunk_points],
+                    wavelength,
+                )
+            )
+
+    for _ in range(2 * max(SCAN_PROCESSES, 1)):
+        submit_next()
+
+    try:
+        while in_flight:
+            chunk = await in_flight[0]
+            in_flight.popleft()
+            submit_next()
+            yield chunk
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+async def solve_in_parallel(
+    hklcalc: HklCalculation,
+    points: Sequence[Point],
+    wavelength: float,
+    chunk_points: Optional[int] = None,
+) -> List[Solutions]:
+    """
+    Solutions for every point, in the order of points.
+    """
+    return [
+        solutions
+        async for chunk in iter_parallel_solutions(
+            hklcalc, points, wavelength, chunk_points
+        )
+        for solutions in chunk
+    ]
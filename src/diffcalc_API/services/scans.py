@@ -0,0 +1,87 @@
+"""
+Results of the scan services, in either of the shapes the scan endpoints return.
+
+By point, results are keyed by the scan coordinates formatted as strings, each with
+a list of solutions as dicts. Columnar results are flat NumPy arrays instead: one
+per scan coordinate with a value per point, then one per motor and virtual angle
+with a value per solution. The point array gives the index of the scan point each
+solution belongs to.
+"""
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+from diffcalc.hkl.geometry import Position
+
+from diffcalc_API.models.hkl import MillerIndicesParams
+from diffcalc_API.services.parallel import Solutions
+
+
+class ScanFormat(str, Enum):
+    points = "points"
+    columnar = "columnar"
+
+
+@dataclass
+class ScanResult:
+    coordinates: Dict[str, np.ndarray]
+    keys: List[str]
+    solutions: Sequence[Solutions]
+
+    def by_point(self) -> Dict[str, Solutions]:
+        return dict(zip(self.keys, self.solutions))
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {
+            **{f"scan_{name}": values for name, values in self.coordinates.items()},
+            **solution_columns(self.solutions),
+        }
+
+    def render(self, scan_format: ScanFormat) -> Dict[str, Any]:
+        if scan_format == ScanFormat.columnar:
+            return self.columns()
+        return self.by_point()
+
+
+def solution_columns(solutions: Sequence[Solutions]) -> Dict[str, np.ndarray]:
+    """
+    The point array, then one array per motor and virtual angle, for a list of
+    solutions per point.
+    """
+    rows = [solution for point in solutions for solution in point]
+    names = list(rows[0]) if rows else list(Position.fields)
+
+    # transposed so that each column is contiguous
+    table = np.array(
+        [[row[name] for name in names] for row in rows], dtype=float
+    ).reshape(-1, len(names))
+    table = np.ascontiguousarray(table.T)
+
+    return {
+        "point": np.repeat(
+            np.arange(len(solutions)), [len(point) for point in solutions]
+        ),
+        **dict(zip(names, table)),
+    }
+
+
+def lab_position_batch_columns(
+    entries: Sequence[MillerIndicesParams], results: Sequence[Dict[str, Any]]
+) -> Dict[str, np.ndarray]:
+    """
+    Columns for a batch of lab position calculations: the Miller indices,
+    wavelength and status code of each entry, then the solutions of every entry
+    that succeeded with point giving the index of its entry.
+    """
+    miller_indices = np.array(
+        [entry.miller_indices for entry in entries], dtype=float
+    ).reshape(-1, 3)
+
+    return {
+        **dict(zip("hkl", np.ascontiguousarray(miller_indices.T))),
+        "wavelength": np.array([entry.wavelength for entry in entries], dtype=float),
+        "status_code": np.array([result["status_code"] for result in results]),
+        **solution_columns([result.get("payload", []) for result in results]),
+    }
@@ -0,0 +1,205 @@
+"""
+Streaming conversion of recorded motor trajectories to Miller indices.
+
+A trajectory is a CSV or NDJSON body with one six-circle position per line. Lines are
+read from the request as they arrive and converted TRAJECTORY_CHUNK_ROWS at a time,
+so memory use does not grow with the length of the trajectory.
+
+CSV rows hold mu, delta, nu, eta, chi and phi in that order, unless the first line is
+a header naming those columns. NDJSON rows are either six-element arrays or objects
+keyed by axis name. The response has one h, k, l row per input row, in the same
+format. A row that cannot be parsed ends the response with an error line, after the
+rows before it. Rows are numbered from 1, not counting a CSV header.
+"""
+
+import io
+import json
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from diffcalc_API.config import TRAJECTORY_CHUNK_ROWS
+from diffcalc_API.services.geometry import miller_indices_from_lab_positions
+
+AXES = ("mu", "delta", "nu", "eta", "chi", "phi")
+PARSE_ERRORS = (ValueError, KeyError, TypeError, IndexError)
+
+
+class CsvTrajectory:
+    media_type = "text/csv"
+
+    def __init__(self) -> None:
+        self._columns: Optional[List[int]] = None
+        self._first_line = True
+
+    def header(self) -> bytes:
+        return b"h,k,l\n"
+
+    def data_lines(self, lines: List[bytes]) -> List[bytes]:
+        if not self._first_line:
+            return lines
+
+        self._first_line = False
+        fields = [field.strip() for field in lines[0].decode().split(",")]
+        if _is_number(fields[0]):
+            return lines
+
+        missing = [axis for axis in AXES if axis not in fields]
+        if missing:
+            raise ValueError(f"CSV header has no column for {missing}")
+        self._columns = [fields.index(axis) for axis in AXES]
+        return lines[1:]
+
+    def parse(self, lines: List[bytes]) -> np.ndarray:
+        if not lines:
+            return np.empty((0, len(AXES)))
+
+        rows = np.loadtxt(
+            [line.decode() for line in lines], delimiter=",", ndmin=2, dtype=float
+        )
+        if self._columns is not None:
+            return rows[:, self._columns]
+
+        if rows.size and rows.shape[1] != len(AXES):
+            raise ValueError(f"expected {len(AXES)} columns, got {rows.shape[1]}")
+        return rows.reshape(-1, len(AXES))
+
+    def format(self, hkl: np.ndarray) -> bytes:
+        buffer = io.StringIO()
+        np.savetxt(buffer, hkl, fmt="%.17g", delimiter=",")
+        return buffer.getvalue().encode()
+
+    def error(self, message: str) -> bytes:
+        return f"# error: {message}\n".encode()
+
+
+class NdjsonTrajectory:
+    media_type = "application/x-ndjson"
+
+    def header(self) -> bytes:
+        return b""
+
+    def data_lines(self, lines: List[bytes]) -> List[bytes]:
+        return lines
+
+    def parse(self, lines: List[bytes]) -> np.ndarray:
+        rows = []
+        for line in lines:
+            row = json.loads(line)
+            rows.append([row[axis] for axis in AXES] if isinstance(row, dict) else row)
+
+        positions = np.array(rows, dtype=float)
+        if positions.ndim != 2 or positions.shape[1] != len(AXES):
+            raise ValueError(f"expected rows of {len(AXES)} angles")
+        return positions
+
+    def format(self, hkl: np.ndarray) -> bytes:
+        return "".join(json.dumps(row) + "\n" for row in hkl.tolist()).encode()
+
+    def error(self, message: str) -> bytes:
+        return (json.dumps({"error": message}) + "\n").encode()
+
+
+Trajectory = Union[CsvTrajectory, NdjsonTrajectory]
+
+TRAJECTORY_FORMATS: Dict[str, Callable[[], Trajectory]] = {
+    CsvTrajectory.media_type: CsvTrajectory,
+    NdjsonTrajectory.media_type: NdjsonTrajectory,
+}
+
+
+def _is_number(field: str) -> bool:
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Split a stream of arbitrary chunks into non-empty lines.
+    """
+    remainder = b""
+    async for chunk in chunks:
+        *lines, remainder = (remainder + chunk).split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+
+    if remainder.strip():
+        yield remainder
+
+
+async def iter_row_chunks(
+    lines: AsyncIterable[bytes], size: int
+) -> AsyncIterator[List[bytes]]:
+    rows: List[bytes] = []
+    async for line in lines:
+        rows.append(line)
+        if len(rows) == size:
+            yield rows
+            rows = []
+
+    if rows:
+        yield rows
+
+
+def parse_until_error(
+    trajectory: Trajectory, lines: List[bytes]
+) -> Tuple[np.ndarray, Optional[Exception]]:
+    """
+    Parse lines one at a time, up to the first that cannot be parsed. Only used
+    once parsing a whole chunk has failed, to keep the rows before the bad one.
+    """
+    rows = [np.empty((0, len(AXES)))]
+    for line in lines:
+        try:
+            rows.append(trajectory.parse([line]))
+        except PARSE_ERRORS as e:
+            return np.concatenate(rows), e
+
+    return np.concatenate(rows), None
+
+
+async def convert_trajectory(
+    ub: np.ndarray,
+    chunks: AsyncIterable[bytes],
+    trajectory: Trajectory,
+    wavelength: float,
+    chunk_rows: int = TRAJECTORY_CHUNK_ROWS,
+) -> AsyncIterator[bytes]:
+    yield trajectory.header()
+
+    first_row = 1
+    async for lines in iter_row_chunks(iter_lines(chunks), chunk_rows):
+        try:
+            lines = trajectory.data_lines(lines)
+        except PARSE_ERRORS as e:
+            yield trajectory.error(f"header: {e}")
+            return
+
+        error: Optional[Exception] = None
+        try:
+            positions = trajectory.parse(lines)
+        except PARSE_ERRORS:
+            positions, error = parse_until_error(trajectory, lines)
+
+        if len(positions):
+            yield trajectory.format(
+                miller_indices_from_lab_positions(ub, positions, wavelength)
+            )
+        if error is not None:
+            yield trajectory.error(f"row {first_row + len(positions)}: {error}")
+            return
+
+        first_row += len(positions)
@@ -1,3 +1,29 @@
-from . import pickling, protocol
+from . import (
+    base,
+    cache,
+    compact,
+    factory,
+    index,
+    journal,
+    memory,
+    pickling,
+    protocol,
+    serialization,
+    sqlite,
+    versions,
+)
 
-__all__ = ["pickling", "protocol"]
+__all__ = [
+    "base",
+    "cache",
+    "compact",
+    "factory",
+    "index",
+    "journal",
+    "memory",
+    "pickling",
+    "protocol",
+    "serialization",
+    "sqlite",
+    "versions",
+]
@@ -0,0 +1,309 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from copy import deepcopy
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    TypeVar,
+    Union,
+)
+from weakref import WeakValueDictionary
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_API.config import (
+    STORE_CACHE_MAX_BYTES,
+    STORE_CACHE_MAX_ENTRIES,
+    STORE_IO_WORKERS,
+    STORE_WRITE_BEHIND_DELAY,
+)
+from diffcalc_API.errors.definitions import (
+    ALL_RESPONSES,
+    DiffcalcAPIException,
+    ErrorCodes,
+)
+from diffcalc_API.stores.cache import LRUCache
+from diffcalc_API.stores.index import CrystalIndex
+from diffcalc_API.stores.versions import StateVersions
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class Codes(ErrorCodes):
+    attempting_to_overwrite = 405
+    check_crystal_exists = 404
+
+
+responses = {code: ALL_RESPONSES[code] for code in np.unique(Codes().all_codes())}
+
+
+def attempting_to_overwrite(name: str) -> None:
+    raise DiffcalcAPIException(
+        status_code=Codes.attempting_to_overwrite,
+        detail=(
+            f"Crystal {name} already exists!"
+            f"\nEither delete via DELETE request to this URL "
+            f"or change the existing properties. "
+        ),
+    )
+
+
+def check_crystal_exists(found: bool, name: str) -> None:
+    if not found:
+        raise DiffcalcAPIException(
+            status_code=Codes.check_crystal_exists,
+            detail=(
+                f"Crystal {name} not found."
+                f"\nYou need to post to"
+                f" http://localhost:8000/{name}"
+                f" first to create it.\n"
+            ),
+        )
+
+
+class BaseHklCalcStore(ABC):
+    """
+    Shared machinery for stores: blocking storage access runs on a bounded thread
+    pool, loaded crystals are kept in an LRU cache and each crystal has its own
+    asyncio lock and state version. Subclasses implement the blocking _create,
+    _delete, _save and _load, which also keep the index of crystals current, and
+    _names.
+
+    If write_behind_delay is non-zero, saves are held in memory and flushed to disk
+    at most once per delay for each crystal, so bursts of edits to the same crystal
+    cost a single write. Pending writes are flushed on close. A crystal stays
+    pending until it is written, so a failed write is retried after another delay.
+    """
+
+    cache: LRUCache[HklCalculation]
+    index: CrystalIndex
+    versions: StateVersions
+    responses: Dict[Union[int, str], Dict[str, Any]]
+
+    def __init__(
+        self,
+        cache_max_entries: int = STORE_CACHE_MAX_ENTRIES,
+        cache_max_bytes: int = STORE_CACHE_MAX_BYTES,
+        io_workers: int = STORE_IO_WORKERS,
+        write_behind_delay: float = STORE_WRITE_BEHIND_DELAY,
+    ) -> None:
+        self._write_behind_delay = write_behind_delay
+        self._locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+        self._pending: Dict[str, HklCalculation] = {}
+        self._flushes: Dict[str, asyncio.Task] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=io_workers, thread_name_prefix="hklcalc-store"
+        )
+        self.cache = LRUCache(cache_max_entries, cache_max_bytes)
+        self.index = CrystalIndex()
+        self.versions = StateVersions()
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def create(self, name: str) -> None:
+        ubcalc = UBCalculation(name=name)
+        constraints = Constraints()
+        hkl = HklCalculation(ubcalc, constraints)
+
+        await self._run(self._create, name, hkl)
+        self.versions.bump(name)
+
+    async def delete(self, name: str) -> None:
+        async with self.lock(name):
+            self._pending.pop(name, None)
+            flush = self._flushes.pop(name, None)
+            if flush is not None:
+                flush.cancel()
+
+            await self._run(self._delete, name)
+            self.versions.bump(name)
+
+    async def save(self, name: str, calc: HklCalculation) -> None:
+        if self._write_behind_delay <= 0:
+            await self._run(self._save, name, calc)
+            self.versions.bump(name)
+            return
+
+        self._pending[name] = calc
+        self.versions.bump(name)
+        if name not in self._flushes:
+            self._flushes[name] = asyncio.create_task(self._flush_later(name))
+
+    async def load(self, name: str) -> HklCalculation:
+        pending = self._pending.get(name)
+        if pending is not None:
+            return pending
+
+        return await self._run(self._load, name)
+
+    async def load_for_update(self, name: str) -> HklCalculation:
+        """
+        Loaded crystals are shared with every reader, including calculations running
+        on other threads, so edits are made to a copy. The copy replaces the loaded
+        crystal only once it has been saved.
+        """
+        calc = await self.load(name)
+        copy = deepcopy(calc)
+        self._copied(calc, copy)
+        return copy
+
+    @asynccontextmanager
+    async def lock(self, name: str) -> AsyncIterator[None]:
+        lock = self._locks.get(name)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[name] = lock
+
+        async with lock:
+            yield
+
+    async def current_version(self, name: str) -> int:
+        """
+        State version of a crystal, without loading it. Stores that other processes
+        can write to check storage for their changes first.
+        """
+        return self.versions.get(name)
+
+    async def state_tag(self, name: str) -> Optional[str]:
+        """
+        Tag for the stored state of a crystal, which ETags are built from. Stores
+        that keep crystals where other processes can read them derive it from what
+        storage records, so every process, before and after a restart, gives the
+        same tag for the same state. This fallback only holds within this store.
+        """
+        return f"{self.versions.epoch}-{self.versions.get(name)}"
+
+    def rebuild_index(self) -> None:
+        """
+        Index every crystal in storage. Blocking, so only call it on startup.
+        """
+        self.index.clear()
+        for name in self._names():
+            try:
+                self._load(name)
+            except Exception:
+                # not a crystal, or unreadable; either way it has no place in listings
+                continue
+
+    async def refresh_index(self) -> None:
+        """
+        Bring the index up to date with crystals that other processes sharing the
+        storage have created or deleted since it was built.
+        """
+        await self._run(self._refresh_index)
+
+    def _refresh_index(self) -> None:
+        stored = set(self._names())
+        for name in self.index.names():
+            if name not in stored:
+                self.index.discard(name)
+
+        for name in stored.difference(self.index.names()):
+            try:
+                self._load(name)
+            except Exception:
+                continue
+
+    async def flush(self) -> None:
+        """
+        Write every pending crystal. Crystals that fail to write stay pending, and
+        the first failure is raised once all of them have been tried.
+        """
+        for flush in list(self._flushes.values()):
+            flush.cancel()
+        self._flushes.clear()
+
+        failures = []
+        for name, calc in list(self._pending.items()):
+            try:
+                await self._write_pending(name, calc)
+            except Exception as error:
+                failures.append(error)
+
+        if failures:
+            raise failures[0]
+
+    async def close(self) -> None:
+        try:
+            await self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    async def _flush_later(self, name: str) -> None:
+        await asyncio.sleep(self._write_behind_delay)
+        async with self.lock(name):
+            self._flushes.pop(name, None)
+            calc = self._pending.get(name)
+            if calc is None:
+                return
+
+            try:
+                await self._write_pending(name, calc)
+            except DiffcalcAPIException:
+                return
+            except Exception:
+                if name not in self._flushes:
+                    self._flushes[name] = asyncio.create_task(self._flush_later(name))
+
+    async def _write_pending(self, name: str, calc: HklCalculation) -> None:
+        """
+        The request that made a pending edit has already been answered, so failures
+        to write it are logged here. Edits that storage refuses, such as those to a
+        crystal another process has since changed or deleted, can never be written
+        and are dropped; any other failure leaves the edit pending.
+        """
+        try:
+            await self._run(self._save, name, calc)
+        except DiffcalcAPIException as error:
+            logger.error("Dropped pending edit to crystal %s: %s", name, error.detail)
+            if self._pending.get(name) is calc:
+                del self._pending[name]
+            raise
+        except Exception:
+            logger.exception("Failed to write pending edit to crystal %s", name)
+            raise
+
+        # a save made while the write ran holds a newer edit, which stays pending
+        if self._pending.get(name) is calc:
+            del self._pending[name]
+
+    def _copied(self, calc: HklCalculation, copy: HklCalculation) -> None:
+        """
+        Called with each copy made for an update, for stores that track what they
+        know about a loaded crystal.
+        """
+        return
+
+    @abstractmethod
+    def _create(self, name: str, calc: HklCalculation) -> None:
+        ...
+
+    @abstractmethod
+    def _delete(self, name: str) -> None:
+        ...
+
+    @abstractmethod
+    def _save(self, name: str, calc: HklCalculation) -> None:
+        ...
+
+    @abstractmethod
+    def _load(self, name: str) -> HklCalculation:
+        ...
+
+    @abstractmethod
+    def _names(self) -> Iterable[str]:
+        ...
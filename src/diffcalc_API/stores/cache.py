@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class LRUCache(Generic[V]):
+    """
+    Least recently used cache bounded both by number of entries and by the
+    approximate number of bytes held.
+
+    Each entry may carry a stamp (e.g. file modification time and size). A lookup
+    with a different stamp is treated as a miss and drops the stale entry.
+    A limit of zero disables the cache. All operations are thread safe.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self.nbytes = 0
+        self._lock = Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[V, int, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, stamp: Any = None) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != stamp:
+                if entry is not None:
+                    self._pop(key)
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: V, nbytes: int, stamp: Any = None) -> None:
+        with self._lock:
+            self._pop(key)
+            if self.max_entries <= 0 or nbytes > self.max_bytes:
+                return
+
+            self._entries[key] = (value, nbytes, stamp)
+            self.nbytes += nbytes
+
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+                self.stats.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            return self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _pop(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        self.nbytes -= entry[1]
+        return entry[0]
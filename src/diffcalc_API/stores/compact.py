@@ -0,0 +1,30 @@
+import pickle
+from pathlib import Path
+
+from diffcalc.hkl.calc import HklCalculation
+
+from diffcalc_API.config import STORE_COMPRESSION
+from diffcalc_API.stores.pickling import PicklingHklCalcStore
+from diffcalc_API.stores.serialization import decode, encode, is_encoded
+
+
+class CompactHklCalcStore(PicklingHklCalcStore):
+    """
+    Stores each crystal as a file in the versioned format of
+    diffcalc_API.stores.serialization. Files still holding a raw pickle are read
+    transparently and rewritten in the new format on their next save.
+    """
+
+    def __init__(
+        self, root_directory: Path, compression: str = STORE_COMPRESSION, **kwargs
+    ) -> None:
+        super().__init__(root_directory, **kwargs)
+        self._compression = compression
+
+    def _dumps(self, calc: HklCalculation) -> bytes:
+        return encode(calc, self._compression)
+
+    def _loads(self, data: bytes) -> HklCalculation:
+        if is_encoded(data):
+            return decode(data)
+        return pickle.loads(data)
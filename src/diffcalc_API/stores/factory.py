@@ -0,0 +1,61 @@
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from diffcalc_API.config import (
+    MEMORY_SNAPSHOT_FOLDER,
+    SAVE_PICKLES_FOLDER,
+    SQLITE_DATABASE,
+    STORE_BACKEND,
+)
+from diffcalc_API.stores import base, pickling, sqlite
+from diffcalc_API.stores.base import BaseHklCalcStore
+from diffcalc_API.stores.compact import CompactHklCalcStore
+from diffcalc_API.stores.journal import JournalHklCalcStore
+from diffcalc_API.stores.memory import InMemoryHklCalcStore
+from diffcalc_API.stores.pickling import PicklingHklCalcStore
+from diffcalc_API.stores.protocol import HklCalcStore
+from diffcalc_API.stores.sqlite import SqliteHklCalcStore
+
+STORES: Dict[str, Callable[[], BaseHklCalcStore]] = {
+    "pickling": lambda: PicklingHklCalcStore(Path(SAVE_PICKLES_FOLDER)),
+    "compact": lambda: CompactHklCalcStore(Path(SAVE_PICKLES_FOLDER)),
+    "journal": lambda: JournalHklCalcStore(Path(SAVE_PICKLES_FOLDER)),
+    "sqlite": lambda: SqliteHklCalcStore(Path(SQLITE_DATABASE)),
+    "memory": lambda: InMemoryHklCalcStore(Path(MEMORY_SNAPSHOT_FOLDER)),
+}
+
+responses = {**base.responses, **pickling.responses, **sqlite.responses}
+
+
+def create_store(backend: str) -> BaseHklCalcStore:
+    if backend not in STORES:
+        raise ValueError(f"Unknown store backend {backend}. Choose one of {STORES}")
+
+    store = STORES[backend]()
+    store.rebuild_index()
+
+    return store
+
+
+_store: Optional[BaseHklCalcStore] = None
+
+
+def setup_store() -> None:
+    global _store
+    if _store is None:
+        _store = create_store(STORE_BACKEND)
+
+
+async def teardown_store() -> None:
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
+
+
+def get_store() -> HklCalcStore:
+    if _store is None:
+        setup_store()
+
+    assert _store is not None
+    return _store
@@ -0,0 +1,84 @@
+import time
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, List, Optional
+
+from diffcalc.hkl.calc import HklCalculation
+
+
+@dataclass
+class CrystalInfo:
+    name: str
+    created: float  # seconds since the epoch
+    modified: float  # seconds since the epoch
+    size: Optional[int]  # bytes in storage, if the store keeps crystals there
+    reflections: int
+    ub_calculated: bool
+
+
+class CrystalIndex:
+    """
+    In-memory index of the crystals in a store, kept sorted by name so that pages
+    of the listing are cheap to slice. Thread-safe.
+
+    Crystals found when the store starts report their modification time as their
+    creation time, since none of the backends records when a crystal was created.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._crystals: Dict[str, CrystalInfo] = {}
+        self._names: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._crystals)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._crystals
+
+    def get(self, name: str) -> Optional[CrystalInfo]:
+        return self._crystals.get(name)
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._names)
+
+    def record(
+        self,
+        name: str,
+        calc: HklCalculation,
+        size: Optional[int],
+        modified: Optional[float] = None,
+    ) -> None:
+        modified = time.time() if modified is None else modified
+
+        with self._lock:
+            previous = self._crystals.get(name)
+            if previous is None:
+                insort(self._names, name)
+
+            self._crystals[name] = CrystalInfo(
+                name=name,
+                created=modified if previous is None else previous.created,
+                modified=modified,
+                size=size,
+                reflections=len(calc.ubcalc.reflist.reflections),
+                ub_calculated=calc.ubcalc.UB is not None,
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._crystals.clear()
+            self._names.clear()
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            if self._crystals.pop(name, None) is not None:
+                del self._names[bisect_left(self._names, name)]
+
+    def page(self, offset: int, limit: int) -> List[CrystalInfo]:
+        with self._lock:
+            return [
+                self._crystals[name] for name in self._names[offset : offset + limit]
+            ]
@@ -0,0 +1,274 @@
+import os
+import pickle
+import struct
+import zlib
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_API.config import JOURNAL_COMPACT_BYTES, JOURNAL_COMPACT_OPS
+from diffcalc_API.stores.base import check_crystal_exists
+from diffcalc_API.stores.pickling import (
+    PicklingHklCalcStore,
+    file_stamp,
+    write_atomically,
+)
+
+RECORD_HEADER = struct.Struct("<II")  # payload length, crc32 of payload
+
+Sections = Dict[str, bytes]
+
+
+@dataclass
+class JournalState:
+    sections: Sections = field(default_factory=dict)
+    ops: int = 0
+    size: int = 0
+    stamp: Optional[Hashable] = None
+
+
+def split_sections(calc: HklCalculation) -> Sections:
+    """
+    Pickle each attribute of the HklCalculation and its UBCalculation separately,
+    so that an edit only touches the sections it changed.
+    """
+    sections = {
+        f"ubcalc.{attr}": pickle.dumps(value)
+        for attr, value in vars(calc.ubcalc).items()
+    }
+    sections.update(
+        {
+            attr: pickle.dumps(value)
+            for attr, value in vars(calc).items()
+            if attr != "ubcalc"
+        }
+    )
+    return sections
+
+
+def join_sections(sections: Sections) -> HklCalculation:
+    hkl = HklCalculation(UBCalculation(), Constraints())
+    for key, value in sections.items():
+        owner, _, attr = key.rpartition(".")
+        vars(hkl.ubcalc if owner else hkl)[attr] = pickle.loads(value)
+
+    return hkl
+
+
+def read_records(stream) -> Iterator[Tuple[Sections, int]]:
+    """
+    Yield each complete journal record with the offset just past it. Reading stops
+    at the first torn or corrupt record, which is what a crash mid-append leaves.
+    """
+    offset = 0
+    while True:
+        header = stream.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+
+        offset += RECORD_HEADER.size + length
+        yield pickle.loads(payload), offset
+
+
+def fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class JournalHklCalcStore(PicklingHklCalcStore):
+    """
+    Stores each crystal as a snapshot plus an append-only journal of edits.
+
+    Every save appends one fsynced record holding only the sections of the crystal
+    that changed since the previous save. Loading replays the journal over the
+    snapshot. Once the journal holds compact_ops records or compact_bytes bytes, the
+    current state is written to a new snapshot (atomically, via rename) and the
+    journal is emptied. Snapshots are pickled crystals, as PicklingHklCalcStore
+    writes them, so the other stores on the same folder can still read them.
+
+    Before appending, the snapshot and journal are checked against the state this
+    process last saw, and replayed again if another process has written to them.
+    """
+
+    def __init__(
+        self,
+        root_directory: Path,
+        compact_ops: int = JOURNAL_COMPACT_OPS,
+        compact_bytes: int = JOURNAL_COMPACT_BYTES,
+        **kwargs,
+    ) -> None:
+        super().__init__(root_directory, **kwargs)
+        self._compact_ops = compact_ops
+        self._compact_bytes = compact_bytes
+        self._states: Dict[str, JournalState] = {}
+        self._states_lock = Lock()
+
+    def _snapshot_path(self, name: str) -> Path:
+        return self._root_directory / name
+
+    def _journal_path(self, name: str) -> Path:
+        return self._root_directory / f"{name}.journal"
+
+    def _stamp(self, name: str) -> Any:
+        generation = self._generation(name)
+        try:
+            journal = os.stat(self._journal_path(name))
+            journal_stamp = journal.st_mtime_ns, journal.st_size
+        except FileNotFoundError:
+            journal_stamp = 0, 0
+
+        return generation, file_stamp(self._snapshot_path(name)), journal_stamp
+
+    def _stored(
+        self, name: str, calc: HklCalculation, nbytes: int, stamp: Any = None
+    ) -> None:
+        stamp = self._stamp(name) if stamp is None else stamp
+        _, (_, snapshot_modified, snapshot_size), journal = stamp
+        journal_modified, journal_size = journal
+
+        self.cache.put(name, calc, nbytes, stamp)
+        self.index.record(
+            name,
+            calc,
+            snapshot_size + journal_size,
+            max(snapshot_modified, journal_modified) / 1e9,
+        )
+        self.versions.observe(name, stamp)
+
+    def _names(self) -> Iterator[str]:
+        for name in super()._names():
+            if not name.endswith(".journal"):
+                yield name
+
+    def _delete(self, name: str) -> None:
+        try:
+            self._snapshot_path(name).unlink()
+        except FileNotFoundError:
+            check_crystal_exists(False, name)
+        finally:
+            with self._states_lock:
+                self._states.pop(name, None)
+            self.index.discard(name)
+            self.cache.pop(name)
+
+        with suppress(FileNotFoundError):
+            self._journal_path(name).unlink()
+        self._unlink_sidecars(name)
+
+    def _save(self, name: str, calc: HklCalculation) -> None:
+        sections = split_sections(calc)
+        with self._states_lock:
+            state = self._states.get(name)
+
+        if self._snapshot_path(name).is_file():
+            if state is None or state.stamp != self._stamp(name):
+                state = self._replay(name)
+        else:
+            state = None
+
+        if state is None:
+            state = self._write_snapshot(name, calc, sections)
+        else:
+            changed = {
+                key: value
+                for key, value in sections.items()
+                if state.sections.get(key) != value
+            }
+            if changed:
+                state = self._append(name, state, sections, changed)
+
+            if state.ops >= self._compact_ops or state.size >= self._compact_bytes:
+                state = self._write_snapshot(name, calc, sections)
+
+        with self._states_lock:
+            self._states[name] = state
+        self._stored(name, calc, sum(map(len, sections.values())), state.stamp)
+
+    def _load(self, name: str) -> HklCalculation:
+        try:
+            stamp = self._stamp(name)
+            cached = self.cache.get(name, stamp)
+            if cached is not None and name in self.index:
+                return cached
+
+            state = self._replay(name)
+        except FileNotFoundError:
+            # deleted, possibly by another process
+            self.index.discard(name)
+            check_crystal_exists(False, name)
+
+        hkl = join_sections(state.sections)
+        with self._states_lock:
+            self._states[name] = state
+        self._stored(name, hkl, sum(map(len, state.sections.values())), state.stamp)
+
+        return hkl
+
+    def _replay(self, name: str) -> JournalState:
+        # taken first, so a concurrent append makes the state look stale, not fresh
+        stamp = self._stamp(name)
+        with open(self._snapshot_path(name), "rb") as stream:
+            snapshot = pickle.load(stream)
+
+        # snapshots written before they were pickled crystals hold the sections
+        if isinstance(snapshot, HklCalculation):
+            snapshot = split_sections(snapshot)
+
+        state = JournalState(sections=snapshot, stamp=stamp)
+        journal_path = self._journal_path(name)
+        if not journal_path.is_file():
+            return state
+
+        with open(journal_path, "rb") as stream:
+            for changed, offset in read_records(stream):
+                state.sections.update(changed)
+                state.ops += 1
+                state.size = offset
+
+        return state
+
+    def _append(
+        self, name: str, state: JournalState, sections: Sections, changed: Sections
+    ) -> JournalState:
+        payload = pickle.dumps(changed)
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with open(self._journal_path(name), "ab") as stream:
+            # drop any torn record left behind by a crash before appending after it
+            if stream.tell() != state.size:
+                stream.truncate(state.size)
+            stream.write(record)
+            stream.flush()
+            os.fsync(stream.fileno())
+        self._bump_generation(name)
+
+        return JournalState(
+            sections, state.ops + 1, state.size + len(record), self._stamp(name)
+        )
+
+    def _write_snapshot(
+        self, name: str, calc: HklCalculation, sections: Sections
+    ) -> JournalState:
+        write_atomically(self._snapshot_path(name), pickle.dumps(calc))
+        # records already in the journal are older than the snapshot, and replaying
+        # them over it ends in the same state, so a crash here is harmless
+        with suppress(FileNotFoundError):
+            self._journal_path(name).unlink()
+        fsync_directory(self._root_directory)
+        self._bump_generation(name)
+
+        return JournalState(sections, stamp=self._stamp(name))
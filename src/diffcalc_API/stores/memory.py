@@ -0,0 +1,183 @@
+import asyncio
+import pickle
+from contextlib import suppress
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.ub.calc import UBCalculation
+
+from diffcalc_API.config import MEMORY_SNAPSHOT_INTERVAL, STORE_COMPRESSION
+from diffcalc_API.stores.base import (
+    BaseHklCalcStore,
+    attempting_to_overwrite,
+    check_crystal_exists,
+    responses,
+)
+from diffcalc_API.stores.pickling import write_atomically
+from diffcalc_API.stores.serialization import decode, encode, is_encoded
+
+
+class InMemoryHklCalcStore(BaseHklCalcStore):
+    """
+    Keeps live HklCalculation objects in memory, keyed by crystal name.
+
+    If a snapshot directory is given, crystals are restored from it on construction.
+    Crystals changed since the last snapshot are written back to it, in the format
+    of CompactHklCalcStore, every snapshot_interval seconds and on close.
+    """
+
+    def __init__(
+        self,
+        snapshot_directory: Optional[Path] = None,
+        snapshot_interval: float = MEMORY_SNAPSHOT_INTERVAL,
+        compression: str = STORE_COMPRESSION,
+        **kwargs,
+    ) -> None:
+        super().__init__(cache_max_entries=0, write_behind_delay=0, **kwargs)
+        self._snapshot_directory = snapshot_directory
+        self._snapshot_interval = snapshot_interval
+        self._compression = compression
+        self._crystals: Dict[str, HklCalculation] = {}
+        self._dirty: Set[str] = set()
+        self._deleted: Set[str] = set()
+        self._snapshots: Optional[asyncio.Task] = None
+        self.responses = responses
+
+        if snapshot_directory is not None:
+            self._restore(snapshot_directory)
+
+    async def create(self, name: str) -> None:
+        ubcalc = UBCalculation(name=name)
+        constraints = Constraints()
+        self._create(name, HklCalculation(ubcalc, constraints))
+        self._changed(name)
+
+    async def delete(self, name: str) -> None:
+        self._delete(name)
+        self.versions.bump(name)
+
+    async def save(self, name: str, calc: HklCalculation) -> None:
+        self._save(name, calc)
+        self._changed(name)
+
+    async def load(self, name: str) -> HklCalculation:
+        return self._load(name)
+
+    def _changed(self, name: str) -> None:
+        self.versions.bump(name)
+        if self._snapshot_directory is None:
+            return
+
+        if self._snapshots is None or self._snapshots.done():
+            self._snapshots = asyncio.create_task(self._snapshot_periodically())
+
+    # the storage hooks only touch dictionaries here, so they are called on the
+    # event loop rather than on the I/O pool
+
+    def _create(self, name: str, calc: HklCalculation) -> None:
+        if name in self._crystals:
+            attempting_to_overwrite(name)
+
+        self._save(name, calc)
+
+    def _delete(self, name: str) -> None:
+        check_crystal_exists(name in self._crystals, name)
+
+        del self._crystals[name]
+        self.index.discard(name)
+        self._dirty.discard(name)
+        self._deleted.add(name)
+
+    def _save(self, name: str, calc: HklCalculation) -> None:
+        self._crystals[name] = calc
+        self.index.record(name, calc, None)
+        self._dirty.add(name)
+        self._deleted.discard(name)
+
+    def _load(self, name: str) -> HklCalculation:
+        check_crystal_exists(name in self._crystals, name)
+        return self._crystals[name]
+
+    def _names(self) -> List[str]:
+        return list(self._crystals)
+
+    def rebuild_index(self) -> None:
+        # crystals are indexed as they are restored from snapshots, and on every save
+        return
+
+    async def refresh_index(self) -> None:
+        # no other process can change the crystals of this one
+        return
+
+    async def snapshot(self) -> None:
+        if self._snapshot_directory is None:
+            return
+
+        # encode on the event loop, so no request can mutate a crystal mid-encoding
+        encoded = {
+            name: encode(self._crystals[name], self._compression)
+            for name in self._dirty
+        }
+        deleted = set(self._deleted)
+        self._dirty.clear()
+        self._deleted.clear()
+
+        try:
+            await self._run(self._write_snapshot, encoded, deleted)
+        except Exception:
+            # retry these crystals with the next snapshot
+            self._dirty.update(name for name in encoded if name in self._crystals)
+            self._deleted.update(deleted - set(self._crystals))
+            raise
+
+    async def close(self) -> None:
+        if self._snapshots is not None:
+            self._snapshots.cancel()
+            self._snapshots = None
+
+        await self.snapshot()
+        await super().close()
+
+    async def _snapshot_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            with suppress(OSError):
+                await self.snapshot()
+
+    def _write_snapshot(self, encoded: Dict[str, bytes], deleted: Set[str]) -> None:
+        assert self._snapshot_directory is not None
+
+        for name, data in encoded.items():
+            write_atomically(self._snapshot_directory / name, data)
+
+        for name in deleted:
+            with suppress(FileNotFoundError):
+                (self._snapshot_directory / name).unlink()
+
+    def _restore(self, snapshot_directory: Path) -> None:
+        snapshot_directory.mkdir(parents=True, exist_ok=True)
+        for path in snapshot_directory.iterdir():
+            if (
+                not path.is_file()
+                or path.name.startswith(".")
+                or path.suffix == ".journal"
+            ):
+                continue
+
+            try:
+                data = path.read_bytes()
+                calc = decode(data) if is_encoded(data) else pickle.loads(data)
+            except Exception:
+                # not a crystal, or unreadable; either way it is not restored
+                continue
+            if not isinstance(calc, HklCalculation):
+                # such as a snapshot of sections written by JournalHklCalcStore
+                continue
+            if path.with_name(f"{path.name}.journal").exists():
+                # a snapshot that its journal has moved on from
+                continue
+
+            self._crystals[path.name] = calc
+            self.index.record(path.name, calc, None, path.stat().st_mtime)
@@ -0,0 +1,64 @@
+"""
+Convert pickled crystals to the versioned format of diffcalc_API.stores.serialization.
+
+    python -m diffcalc_API.stores.migrate [folder] [--compression zlib] [--dry-run]
+
+Each file is rewritten atomically. Files already in the new format, hidden files
+and journal files are left alone.
+"""
+
+import pickle
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List, Optional
+
+from diffcalc.hkl.calc import HklCalculation
+
+from diffcalc_API.config import SAVE_PICKLES_FOLDER, STORE_COMPRESSION
+from diffcalc_API.stores.pickling import write_atomically
+from diffcalc_API.stores.serialization import COMPRESSIONS, encode, is_encoded
+
+
+def migrate_file(path: Path, compression: str, dry_run: bool = False) -> bool:
+    data = path.read_bytes()
+    if is_encoded(data):
+        return False
+
+    calc = pickle.loads(data)
+    if not isinstance(calc, HklCalculation):
+        return False
+
+    if not dry_run:
+        write_atomically(path, encode(calc, compression))
+
+    return True
+
+
+def migrate_folder(folder: Path, compression: str, dry_run: bool = False) -> List[Path]:
+    migrated = []
+    for path in sorted(folder.iterdir()):
+        if not path.is_file() or path.name.startswith(".") or path.suffix == ".journal":
+            continue
+
+        if migrate_file(path, compression, dry_run):
+            migrated.append(path)
+
+    return migrated
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("folder", nargs="?", default=SAVE_PICKLES_FOLDER)
+    parser.add_argument(
+        "--compression", choices=list(COMPRESSIONS), default=STORE_COMPRESSION
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parsed = parser.parse_args(args)
+
+    migrated = migrate_folder(Path(parsed.folder), parsed.compression, parsed.dry_run)
+    for path in migrated:
+        print(f"{'would migrate' if parsed.dry_run else 'migrated'} {path}")
+
+
+if __name__ == "__main__":
+    main()
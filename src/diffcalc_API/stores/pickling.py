@@ -1,86 +1,248 @@
+import asyncio
+import fcntl
+import os
 import pickle
+import time
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, AsyncIterator, Iterator, Optional, Tuple
 
-import numpy as np
 from diffcalc.hkl.calc import HklCalculation
-from diffcalc.hkl.constraints import Constraints
-from diffcalc.ub.calc import UBCalculation
-
-from diffcalc_API.config import SAVE_PICKLES_FOLDER
-from diffcalc_API.errors.definitions import (
-    ALL_RESPONSES,
-    DiffcalcAPIException,
-    ErrorCodes,
+
+from diffcalc_API.config import FILE_LOCK_POLL_INTERVAL
+from diffcalc_API.stores.base import (
+    BaseHklCalcStore,
+    attempting_to_overwrite,
+    check_crystal_exists,
+    responses,
 )
-from diffcalc_API.stores.protocol import HklCalcStore
+from diffcalc_API.stores.versions import token_tag
 
 
-class Codes(ErrorCodes):
-    attempting_to_overwrite = 405
-    check_file_exists = 404
+def file_stamp(file_path: Path) -> Tuple[int, int, int]:
+    """
+    Cheap change detection for a file. Not enough on its own: a file replaced by
+    rename may reuse a freed inode, and a rewrite of the same size within one tick
+    of a coarse timestamp, as on NFS, leaves the stamp unchanged.
+    """
+    stat = os.stat(file_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
 
 
-def attempting_to_overwrite(filename: str) -> None:
-    pickled_file = Path(SAVE_PICKLES_FOLDER) / filename
-    if (pickled_file).is_file():
-        message = (
-            f"File already exists for crystal {filename}!"
-            f"\nEither delete via DELETE request to this URL "
-            f"or change the existing properties. "
-        )
-        raise DiffcalcAPIException(status_code=405, detail=message)
+def try_lock_file(fd: int) -> bool:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
 
-    return
+    return True
 
 
-def check_file_exists(pickled_file: Path, name: str) -> None:
-    if not (pickled_file).is_file():
-        message = (
-            f"File for crystal {name} not found."
-            f"\nYou need to post to"
-            f" http://localhost:8000/{name}"
-            f" first to generate the pickled file.\n"
-        )
-        raise DiffcalcAPIException(status_code=404, detail=message)
+def write_temporary(file_path: Path, data: bytes, sync: bool = True) -> Path:
+    with NamedTemporaryFile(
+        dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp", delete=False
+    ) as stream:
+        stream.write(data)
+        if sync:
+            stream.flush()
+            os.fsync(stream.fileno())
 
+    return Path(stream.name)
 
-class PicklingHklCalcStore:
-    _root_directory: Path
 
-    def __init__(self, root_directory: Path) -> None:
-        self._root_directory = root_directory
-        self.responses = {
-            code: ALL_RESPONSES[code] for code in np.unique(Codes().all_codes())
-        }
+def write_atomically(file_path: Path, data: bytes, sync: bool = True) -> None:
+    os.replace(write_temporary(file_path, data, sync), file_path)
 
-    async def create(self, name: str) -> None:
-        attempting_to_overwrite(name)
 
-        ubcalc = UBCalculation(name=name)
-        constraints = Constraints()
-        hkl = HklCalculation(ubcalc, constraints)
+class PicklingHklCalcStore(BaseHklCalcStore):
+    """
+    Stores each crystal as a pickled file in the root directory.
 
-        await self.save(name, hkl)
+    Several processes may share the root directory. Files are replaced atomically,
+    lock(name) also takes an advisory file lock on the crystal, and cached crystals
+    are reloaded once their stamp changes. Stamps include a generation counter, kept
+    in .generations and bumped after every write, since the file's own stat can miss
+    a rewrite. Write-behind should stay disabled when the directory is shared, since
+    pending writes are only seen by this process.
+    """
 
-    async def delete(self, name: str) -> None:
-        pickle_file_path = Path(SAVE_PICKLES_FOLDER) / name
-        check_file_exists(pickle_file_path, name)
-        Path(pickle_file_path).unlink()
-
-    async def save(self, name: str, calc: HklCalculation) -> None:
-        file_path = self._root_directory / name
-        with open(file_path, "wb") as stream:
-            pickle.dump(obj=calc, file=stream)
+    _root_directory: Path
 
-    async def load(self, name: str) -> HklCalculation:
+    def __init__(self, root_directory: Path, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._root_directory = root_directory
+        self.responses = responses
+
+    @asynccontextmanager
+    async def lock(self, name: str) -> AsyncIterator[None]:
+        async with super().lock(name):
+            # polled rather than blocking, so a cancelled request never leaves a
+            # thread waiting on a lock that nobody will release
+            fd = await self._run(self._try_lock, name)
+            while fd is None:
+                await asyncio.sleep(FILE_LOCK_POLL_INTERVAL)
+                fd = await self._run(self._try_lock, name)
+
+            try:
+                yield
+            finally:
+                # closed here rather than on the I/O pool, so that cancellation can
+                # never leave the lock held
+                os.close(fd)
+
+    def _lock_path(self, name: str) -> Path:
+        return self._root_directory / ".locks" / name
+
+    def _try_lock(self, name: str) -> Optional[int]:
+        """
+        Open and lock the crystal's lock file, or return None if another process
+        holds it. Lock files are removed with their crystal, so a lock taken on a
+        file that has since been unlinked excludes nobody, and is given up too.
+        """
+        lock_path = self._lock_path(name)
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+        if try_lock_file(fd):
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+
+        os.close(fd)
+        return None
+
+    def _generation_path(self, name: str) -> Path:
+        return self._root_directory / ".generations" / name
+
+    def _generation(self, name: str) -> int:
+        try:
+            return int(self._generation_path(name).read_bytes())
+        except FileNotFoundError:
+            # written before generations were kept, and not saved since
+            return 0
+
+    def _bump_generation(self, name: str, created: bool = False) -> None:
+        """
+        Called after every write to a crystal, which holds lock(name) unless it is
+        creating the crystal. New crystals start from the clock rather than from
+        zero, so they never repeat the generations of a deleted predecessor.
+        """
+        generation_path = self._generation_path(name)
+        generation_path.parent.mkdir(parents=True, exist_ok=True)
+        generation = time.time_ns() if created else self._generation(name) + 1
+        # not synced, since a generation lost in a crash only costs a reload
+        write_atomically(generation_path, str(generation).encode(), sync=False)
+
+    def _unlink_sidecars(self, name: str) -> None:
+        # only called under lock(name), so no other process holds the lock file
+        for path in [self._lock_path(name), self._generation_path(name)]:
+            with suppress(FileNotFoundError):
+                path.unlink()
+
+    def _create(self, name: str, calc: HklCalculation) -> None:
         file_path = self._root_directory / name
-        check_file_exists(file_path, name)
-
-        with open(file_path, "rb") as stream:
-            hkl: HklCalculation = pickle.load(stream)
+        data = self._dumps(calc)
+        temporary_path = write_temporary(file_path, data)
+        try:
+            # link fails if the crystal exists, even if another process created it
+            os.link(temporary_path, file_path)
+        except FileExistsError:
+            attempting_to_overwrite(name)
+        finally:
+            temporary_path.unlink()
+
+        self._bump_generation(name, created=True)
+        self._stored(name, calc, len(data))
+
+    def _delete(self, name: str) -> None:
+        try:
+            (self._root_directory / name).unlink()
+        except FileNotFoundError:
+            check_crystal_exists(False, name)
+        finally:
+            self.index.discard(name)
+            self.cache.pop(name)
+
+        self._unlink_sidecars(name)
+
+    def _names(self) -> Iterator[str]:
+        if not self._root_directory.is_dir():
+            return
+
+        for path in self._root_directory.iterdir():
+            if path.is_file() and not path.name.startswith("."):
+                yield path.name
+
+    def _stamp(self, name: str) -> Tuple[int, int, int, int]:
+        # the generation is read first, so a write racing with this only ever makes
+        # the stamp look older than the file, never newer
+        generation = self._generation(name)
+        return (generation, *file_stamp(self._root_directory / name))
+
+    def _stored(
+        self,
+        name: str,
+        calc: HklCalculation,
+        nbytes: int,
+        stamp: Optional[Tuple[int, int, int, int]] = None,
+    ) -> None:
+        """
+        Cache and index a crystal that has just been written to disk, or read from it
+        when its file had the given stamp.
+        """
+        *_, modified, size = stamp = self._stamp(name) if stamp is None else stamp
+        self.cache.put(name, calc, nbytes, stamp)
+        self.index.record(name, calc, size, modified / 1e9)
+        self.versions.observe(name, stamp)
+
+    async def current_version(self, name: str) -> int:
+        return self.versions.observe(name, await self._run(self._current_stamp, name))
+
+    async def state_tag(self, name: str) -> Optional[str]:
+        if name in self._pending:
+            # not on disk yet, and only this process can see it
+            return await super().state_tag(name)
+
+        stamp = await self._run(self._current_stamp, name)
+        self.versions.observe(name, stamp)
+        return None if stamp is None else token_tag(stamp)
+
+    def _current_stamp(self, name: str) -> Any:
+        try:
+            return self._stamp(name)
+        except FileNotFoundError:
+            return None
+
+    def _dumps(self, calc: HklCalculation) -> bytes:
+        return pickle.dumps(calc)
+
+    def _loads(self, data: bytes) -> HklCalculation:
+        return pickle.loads(data)
+
+    def _save(self, name: str, calc: HklCalculation) -> None:
+        data = self._dumps(calc)
+        write_atomically(self._root_directory / name, data)
+        self._bump_generation(name)
+        self._stored(name, calc, len(data))
+
+    def _load(self, name: str) -> HklCalculation:
+        try:
+            stamp = self._stamp(name)
+            cached = self.cache.get(name, stamp)
+            if cached is not None and name in self.index:
+                return cached
+
+            with open(self._root_directory / name, "rb") as stream:
+                data = stream.read()
+        except FileNotFoundError:
+            # deleted, possibly by another process
+            self.index.discard(name)
+            check_crystal_exists(False, name)
+
+        hkl = self._loads(data)
+        self._stored(name, hkl, len(data), stamp)
 
         return hkl
-
-
-def get_store() -> HklCalcStore:
-    return PicklingHklCalcStore(Path(SAVE_PICKLES_FOLDER))
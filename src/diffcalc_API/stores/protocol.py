@@ -1,7 +1,11 @@
-from typing import Any, Dict, Protocol, Union
+from typing import Any, AsyncContextManager, Dict, Optional, Protocol, Union
 
 from diffcalc.hkl.calc import HklCalculation
 
+from diffcalc_API.stores.cache import LRUCache
+from diffcalc_API.stores.index import CrystalIndex
+from diffcalc_API.stores.versions import StateVersions
+
 
 class HklCalcStore(Protocol):
     """
@@ -9,6 +13,9 @@ class HklCalcStore(Protocol):
     """
 
     responses: Dict[Union[int, str], Dict[str, Any]]
+    cache: LRUCache[HklCalculation]
+    index: CrystalIndex
+    versions: StateVersions
 
     async def create(self, name: str) -> None:
         ...
@@ -21,3 +28,33 @@ class HklCalcStore(Protocol):
 
     async def load(self, name: str) -> HklCalculation:
         ...
+
+    async def load_for_update(self, name: str) -> HklCalculation:
+        """
+        A private copy of a crystal, to change under lock(name) and then save.
+        """
+        ...
+
+    async def current_version(self, name: str) -> int:
+        """
+        State version of a crystal, without loading it.
+        """
+        ...
+
+    async def state_tag(self, name: str) -> Optional[str]:
+        """
+        Tag for the stored state of a crystal, or None if it is not stored.
+        """
+        ...
+
+    async def refresh_index(self) -> None:
+        """
+        Bring the index up to date with changes made by other processes.
+        """
+        ...
+
+    def lock(self, name: str) -> AsyncContextManager[None]:
+        """
+        Exclusive access to a crystal, held around load -> mutate -> save.
+        """
+        ...
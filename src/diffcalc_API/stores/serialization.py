@@ -0,0 +1,176 @@
+"""
+Versioned, compact encoding of the state of an HklCalculation.
+
+An encoded crystal is laid out as::
+
+    b"DCAPI" | format version (1 byte) | compression (1 byte) | body
+
+The body is UTF-8 JSON, optionally compressed with zlib or lzma. Version 1 holds::
+
+    {
+        "name": str,
+        "crystal": null | {"name": str, "system": str, "params": [float, ...]},
+        "reflections": [
+            {"hkl": [h, k, l], "pos": [mu, delta, nu, eta, chi, phi],
+             "energy": float, "tag": null | str}, ...
+        ],
+        "orientations": [
+            {"hkl": [h, k, l], "xyz": [x, y, z],
+             "pos": null | [mu, delta, nu, eta, chi, phi], "tag": null | str}, ...
+        ],
+        "reference": {"n_ref": [float, float, float], "rlv": bool},
+        "surface": {"n_ref": [float, float, float], "rlv": bool},
+        "U": null | 3x3 nested list,
+        "UB": null | 3x3 nested list,
+        "constraints": {str: float | bool}
+    }
+
+Angles are in degrees. "params" is the minimal set of lattice parameters for the
+crystal system, as returned by Crystal.get_lattice_params.
+"""
+
+import json
+import lzma
+import zlib
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import ReferenceVector, UBCalculation
+from diffcalc.ub.crystal import Crystal
+
+MAGIC = b"DCAPI"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+
+COMPRESSIONS: Dict[str, int] = {"none": 0, "zlib": 1, "lzma": 2}
+_COMPRESSORS: Dict[int, Callable[[bytes], bytes]] = {
+    0: lambda data: data,
+    1: lambda data: zlib.compress(data, 1),
+    2: lzma.compress,
+}
+_DECOMPRESSORS: Dict[int, Callable[[bytes], bytes]] = {
+    0: lambda data: data,
+    1: zlib.decompress,
+    2: lzma.decompress,
+}
+
+
+def is_encoded(data: bytes) -> bool:
+    return data[: len(MAGIC)] == MAGIC
+
+
+def _position(pos: Optional[Position]) -> Optional[list]:
+    if pos is None:
+        return None
+    return list(Position.asdegrees(pos).astuple)
+
+
+def _matrix(matrix: Optional[np.ndarray]) -> Optional[list]:
+    return None if matrix is None else np.asarray(matrix).tolist()
+
+
+def _reference(vector: ReferenceVector) -> Dict[str, Any]:
+    return {"n_ref": [float(value) for value in vector.n_ref], "rlv": vector.rlv}
+
+
+def to_dict(calc: HklCalculation) -> Dict[str, Any]:
+    ubcalc = calc.ubcalc
+    crystal = None
+    if ubcalc.crystal is not None:
+        system, params = ubcalc.crystal.get_lattice_params()
+        crystal = {
+            "name": ubcalc.crystal.name,
+            "system": system,
+            "params": list(params),
+        }
+
+    return {
+        "name": ubcalc.name,
+        "crystal": crystal,
+        "reflections": [
+            {
+                "hkl": [r.h, r.k, r.l],
+                "pos": _position(r.pos),
+                "energy": r.energy,
+                "tag": r.tag,
+            }
+            for r in ubcalc.reflist.reflections
+        ],
+        "orientations": [
+            {
+                "hkl": [o.h, o.k, o.l],
+                "xyz": [o.x, o.y, o.z],
+                "pos": _position(o.pos),
+                "tag": o.tag,
+            }
+            for o in ubcalc.orientlist.orientations
+        ],
+        "reference": _reference(ubcalc.reference),
+        "surface": _reference(ubcalc.surface),
+        "U": _matrix(ubcalc.U),
+        "UB": _matrix(ubcalc.UB),
+        "constraints": calc.constraints.asdict,
+    }
+
+
+def from_dict(state: Dict[str, Any]) -> HklCalculation:
+    ubcalc = UBCalculation(name=state["name"])
+
+    crystal = state["crystal"]
+    if crystal is not None:
+        ubcalc.crystal = Crystal(crystal["name"], crystal["system"], *crystal["params"])
+
+    for reflection in state["reflections"]:
+        ubcalc.add_reflection(
+            reflection["hkl"],
+            Position(*reflection["pos"]),
+            reflection["energy"],
+            reflection["tag"],
+        )
+
+    for orientation in state["orientations"]:
+        pos = orientation["pos"]
+        ubcalc.add_orientation(
+            orientation["hkl"],
+            orientation["xyz"],
+            Position(*pos) if pos is not None else None,
+            orientation["tag"],
+        )
+
+    ubcalc.reference = ReferenceVector(
+        tuple(state["reference"]["n_ref"]), state["reference"]["rlv"]
+    )
+    ubcalc.surface = ReferenceVector(
+        tuple(state["surface"]["n_ref"]), state["surface"]["rlv"]
+    )
+    ubcalc.U = None if state["U"] is None else np.array(state["U"])
+    ubcalc.UB = None if state["UB"] is None else np.array(state["UB"])
+
+    return HklCalculation(ubcalc, Constraints(state["constraints"]))
+
+
+def encode(calc: HklCalculation, compression: str = "none") -> bytes:
+    flag = COMPRESSIONS[compression]
+    body = json.dumps(to_dict(calc), separators=(",", ":")).encode()
+
+    return MAGIC + bytes((FORMAT_VERSION, flag)) + _COMPRESSORS[flag](body)
+
+
+def decode(data: bytes) -> HklCalculation:
+    if not is_encoded(data):
+        raise ValueError("data is not an encoded HklCalculation")
+
+    version, flag = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version > FORMAT_VERSION:
+        raise ValueError(
+            f"encoded with format version {version}, "
+            f"newest supported is {FORMAT_VERSION}"
+        )
+    if flag not in _DECOMPRESSORS:
+        raise ValueError(f"unknown compression flag {flag}")
+
+    body = _DECOMPRESSORS[flag](data[HEADER_SIZE:])
+    return from_dict(json.loads(body))
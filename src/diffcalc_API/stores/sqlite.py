@@ -0,0 +1,232 @@
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue
+from typing import Iterator, List, Optional
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from diffcalc.hkl.calc import HklCalculation
+
+from diffcalc_API.config import (
+    SQLITE_BUSY_TIMEOUT,
+    SQLITE_POOL_SIZE,
+    STORE_COMPRESSION,
+)
+from diffcalc_API.errors.definitions import ALL_RESPONSES, DiffcalcAPIException
+from diffcalc_API.stores.base import BaseHklCalcStore
+from diffcalc_API.stores.base import Codes as StoreCodes
+from diffcalc_API.stores.base import attempting_to_overwrite, check_crystal_exists
+from diffcalc_API.stores.serialization import decode, encode
+from diffcalc_API.stores.versions import token_tag
+
+
+class Codes(StoreCodes):
+    check_version = 409
+
+
+responses = {code: ALL_RESPONSES[code] for code in np.unique(Codes().all_codes())}
+
+
+def check_version(rowcount: int, name: str) -> None:
+    if rowcount == 0:
+        raise DiffcalcAPIException(
+            status_code=Codes.check_version,
+            detail=(
+                f"Crystal {name} was modified by another request since it was "
+                f"loaded. Please retry."
+            ),
+        )
+
+
+class SqliteHklCalcStore(BaseHklCalcStore):
+    """
+    Stores all crystals as rows of one SQLite database in WAL mode.
+
+    Each row carries a version number that changes on every save. A save only
+    succeeds if the row still has the version the crystal was loaded at, so
+    concurrent writers from other processes are rejected instead of overwritten.
+    Versions are drawn from one sequence for the whole database, so a crystal that
+    is deleted and created again never repeats the version of its predecessor.
+    """
+
+    def __init__(
+        self,
+        database: Path,
+        pool_size: int = SQLITE_POOL_SIZE,
+        compression: str = STORE_COMPRESSION,
+        busy_timeout: float = SQLITE_BUSY_TIMEOUT,
+        **kwargs,
+    ) -> None:
+        super().__init__(io_workers=pool_size, **kwargs)
+        self._compression = compression
+        self._versions: WeakKeyDictionary[HklCalculation, int] = WeakKeyDictionary()
+        self._pool: Queue[sqlite3.Connection] = Queue()
+        self.responses = responses
+
+        database.parent.mkdir(parents=True, exist_ok=True)
+        for _ in range(pool_size):
+            connection = sqlite3.connect(
+                database,
+                timeout=busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._pool.put(connection)
+
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS crystals ("
+                " name TEXT PRIMARY KEY,"
+                " version INTEGER NOT NULL,"
+                " data BLOB NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                " key TEXT PRIMARY KEY,"
+                " value INTEGER NOT NULL)"
+            )
+            # databases from before the sequence carry on from their newest row
+            connection.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES"
+                " ('version', (SELECT COALESCE(MAX(version), 0) FROM crystals))"
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    @staticmethod
+    def _next_version(connection: sqlite3.Connection) -> int:
+        # only call inside a transaction
+        connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()[0]
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    async def close(self) -> None:
+        await super().close()
+        while not self._pool.empty():
+            self._pool.get().close()
+
+    def _copied(self, calc: HklCalculation, copy: HklCalculation) -> None:
+        version = self._versions.get(calc)
+        if version is not None:
+            self._versions[copy] = version
+
+    def _create(self, name: str, calc: HklCalculation) -> None:
+        data = encode(calc, self._compression)
+        try:
+            with self._transaction() as connection:
+                version = self._next_version(connection)
+                connection.execute(
+                    "INSERT INTO crystals (name, version, data) VALUES (?, ?, ?)",
+                    (name, version, data),
+                )
+        except sqlite3.IntegrityError:
+            attempting_to_overwrite(name)
+
+        self._versions[calc] = version
+        self.index.record(name, calc, len(data))
+        self.versions.observe(name, version)
+
+    def _delete(self, name: str) -> None:
+        with self._connection() as connection:
+            cursor = connection.execute("DELETE FROM crystals WHERE name = ?", (name,))
+
+        self.index.discard(name)
+        self.cache.pop(name)
+        check_crystal_exists(cursor.rowcount > 0, name)
+
+    def _save(self, name: str, calc: HklCalculation) -> None:
+        data = encode(calc, self._compression)
+        version = self._versions.get(calc)
+
+        with self._transaction() as connection:
+            if version is None:
+                row = connection.execute(
+                    "SELECT version FROM crystals WHERE name = ?", (name,)
+                ).fetchone()
+                check_crystal_exists(row is not None, name)
+                version = row[0]
+
+            new_version = self._next_version(connection)
+            cursor = connection.execute(
+                "UPDATE crystals SET version = ?, data = ?"
+                " WHERE name = ? AND version = ?",
+                (new_version, data, name, version),
+            )
+            check_version(cursor.rowcount, name)
+
+        self._versions[calc] = new_version
+        self.cache.put(name, calc, len(data), new_version)
+        self.index.record(name, calc, len(data))
+        self.versions.observe(name, new_version)
+
+    def _load(self, name: str) -> HklCalculation:
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT version FROM crystals WHERE name = ?", (name,)
+            ).fetchone()
+            check_crystal_exists(row is not None, name)
+
+            self.versions.observe(name, row[0])
+            cached = self.cache.get(name, row[0])
+            if cached is not None and name in self.index:
+                return cached
+
+            row = connection.execute(
+                "SELECT version, data FROM crystals WHERE name = ?", (name,)
+            ).fetchone()
+            check_crystal_exists(row is not None, name)
+
+        version, data = row
+        hkl = decode(data)
+        self._versions[hkl] = version
+        self.cache.put(name, hkl, len(data), version)
+        self.index.record(name, hkl, len(data))
+
+        return hkl
+
+    async def current_version(self, name: str) -> int:
+        return self.versions.observe(name, await self._run(self._row_version, name))
+
+    async def state_tag(self, name: str) -> Optional[str]:
+        if name in self._pending:
+            # not in the database yet, and only this process can see it
+            return await super().state_tag(name)
+
+        version = await self._run(self._row_version, name)
+        self.versions.observe(name, version)
+        return None if version is None else token_tag(version)
+
+    def _row_version(self, name: str) -> Optional[int]:
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT version FROM crystals WHERE name = ?", (name,)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def _names(self) -> List[str]:
+        with self._connection() as connection:
+            rows = connection.execute("SELECT name FROM crystals").fetchall()
+
+        return [name for name, in rows]
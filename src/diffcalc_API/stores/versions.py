@@ -0,0 +1,52 @@
+import secrets
+from itertools import count
+from threading import Lock
+from typing import Any, Dict, Hashable
+
+
+def token_tag(token: Any) -> str:
+    """
+    A storage token, such as a file stamp or row version, written as hex digits
+    joined by dashes, for use in an ETag.
+    """
+    if isinstance(token, tuple):
+        return "-".join(token_tag(part) for part in token)
+    return format(token, "x")
+
+
+class StateVersions:
+    """
+    A version number for the state of each crystal, bumped whenever it is created,
+    saved or deleted through the store. Versions are drawn from one counter for the
+    whole store, so a crystal that is deleted and created again never repeats one.
+
+    Versions start again from 0 with every store, so they are only comparable
+    alongside the epoch of the store that issued them. Changes made by other
+    processes are picked up by observing the crystal's token in storage, such as a
+    file stamp, which bumps the version whenever it differs from the last one seen.
+    Thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self.epoch = secrets.token_hex(4)
+        self._lock = Lock()
+        self._counter = count(1)
+        self._versions: Dict[str, int] = {}
+        self._tokens: Dict[str, Hashable] = {}
+
+    def get(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def bump(self, name: str) -> int:
+        with self._lock:
+            version = self._versions[name] = next(self._counter)
+            return version
+
+    def observe(self, name: str, token: Hashable) -> int:
+        with self._lock:
+            if name in self._tokens and self._tokens[name] == token:
+                return self._versions.get(name, 0)
+
+            self._tokens[name] = token
+            version = self._versions[name] = next(self._counter)
+            return version
@@ -0,0 +1,19 @@
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    Streams a response while the request body is still being read.
+
+    StreamingResponse listens for the client disconnecting by reading from receive,
+    which would swallow the rest of the request body. Here only the request body is
+    read from receive: request.stream() raises ClientDisconnect if the client leaves,
+    which ends the response too.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
@@ -1,3 +1,17 @@
-from . import conftest, test_constraints, test_hklcalc, test_ubcalc
+from . import (
+    conftest,
+    test_constraints,
+    test_hklcalc,
+    test_jobs,
+    test_stores,
+    test_ubcalc,
+)
 
-__all__ = ["conftest", "test_constraints", "test_hklcalc", "test_ubcalc"]
+__all__ = [
+    "conftest",
+    "test_constraints",
+    "test_hklcalc",
+    "test_jobs",
+    "test_stores",
+    "test_ubcalc",
+]
@@ -1,21 +1,45 @@
-from typing import Any, Dict, Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Union
 
 from diffcalc.hkl.calc import HklCalculation
 
+from diffcalc_API.stores.cache import LRUCache
+from diffcalc_API.stores.index import CrystalIndex
+from diffcalc_API.stores.versions import StateVersions
+
 
 class FakeHklCalcStore:
     def __init__(self, hkl: HklCalculation):
         self.hkl = hkl
         self.responses: Dict[Union[int, str], Dict[str, Any]] = {}
+        self.cache: LRUCache[HklCalculation] = LRUCache(0, 0)
+        self.index = CrystalIndex()
+        self.versions = StateVersions()
 
     async def create(self, name: str) -> None:
-        pass
+        self.versions.bump(name)
 
     async def delete(self, name: str) -> None:
-        pass
+        self.versions.bump(name)
 
     async def save(self, name: str, calc: HklCalculation) -> None:
-        pass
+        self.versions.bump(name)
 
     async def load(self, name: str) -> HklCalculation:
         return self.hkl
+
+    async def load_for_update(self, name: str) -> HklCalculation:
+        return self.hkl
+
+    async def current_version(self, name: str) -> int:
+        return self.versions.get(name)
+
+    async def state_tag(self, name: str) -> Optional[str]:
+        return str(self.versions.get(name))
+
+    async def refresh_index(self) -> None:
+        return
+
+    @asynccontextmanager
+    async def lock(self, name: str) -> AsyncIterator[None]:
+        yield
@@ -8,7 +8,7 @@ from fastapi.testclient import TestClient
 
 from diffcalc_API.errors.constraints import Codes
 from diffcalc_API.server import app
-from diffcalc_API.stores.pickling import get_store
+from diffcalc_API.stores.factory import get_store
 from diffcalc_API.stores.protocol import HklCalcStore
 from tests.conftest import FakeHklCalcStore
 
@@ -1,14 +1,32 @@
+import asyncio
+import io
+import json
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
 import numpy as np
 import pytest
 from diffcalc.hkl.calc import HklCalculation
 from diffcalc.hkl.constraints import Constraints
 from diffcalc.hkl.geometry import Position
 from diffcalc.ub.calc import UBCalculation
+from diffcalc.util import DiffcalcException
 from fastapi.testclient import TestClient
 
+from diffcalc_API import responses
 from diffcalc_API.errors.hkl import Codes
 from diffcalc_API.server import app
-from diffcalc_API.stores.pickling import get_store
+from diffcalc_API.services import compute
+from diffcalc_API.services import hkl as hkl_service
+from diffcalc_API.services import memo, parallel
+from diffcalc_API.services.coalesce import get_single_flight
+from diffcalc_API.services.compute import ComputeDispatcher
+from diffcalc_API.services.geometry import miller_indices_from_lab_positions
+from diffcalc_API.services.memo import DiskTier, PositionCache
+from diffcalc_API.stores.factory import get_store
 from diffcalc_API.stores.protocol import HklCalcStore
 from tests.conftest import FakeHklCalcStore
 
@@ -86,6 +104,184 @@ def test_scan_hkl(
     assert len(scan_results.keys()) == 9
 
 
+def test_parallel_scan_hkl_matches_serial_scan(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    params = {
+        "start": [1, 0, 1],
+        "stop": [2, 0, 2],
+        "inc": [0.25, 0, 0.25],
+        "wavelength": 1,
+    }
+    serial = client.get("/calculate/test/scan/hkl", params=params).json()["payload"]
+
+    monkeypatch.setattr(hkl_service, "SCAN_PARALLEL_MIN_POINTS", 0)
+    monkeypatch.setattr(parallel, "SCAN_PROCESSES", 2)
+    monkeypatch.setattr(parallel, "SCAN_CHUNK_POINTS", 4)
+    try:
+        response = client.get("/calculate/test/scan/hkl", params=params)
+    finally:
+        parallel.shutdown_scan_pool()
+
+    assert response.status_code == 200
+    assert list(response.json()["payload"]) == list(serial)
+    assert response.json()["payload"] == serial
+
+
+def test_parallel_scans_keep_a_bounded_window_of_chunks(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    pool = ThreadPoolExecutor(max_workers=1)
+    solved: List[int] = []
+    solve_chunk = parallel.solve_chunk
+
+    def counting_solve_chunk(*args):
+        solved.append(len(args[2]))
+        return solve_chunk(*args)
+
+    monkeypatch.setattr(parallel, "get_scan_pool", lambda: pool)
+    monkeypatch.setattr(parallel, "SCAN_PROCESSES", 1)
+    monkeypatch.setattr(parallel, "solve_chunk", counting_solve_chunk)
+    pickled = compute.compute_stats()["heavy"].completed
+
+    async def read_slowly():
+        chunks = parallel.iter_parallel_solutions(
+            dummy_hkl, [(1, 0, 1)] * 20, 1, chunk_points=2
+        )
+        first = await chunks.__anext__()
+        await asyncio.sleep(0.2)
+        submitted = len(solved)
+        return [first] + [chunk async for chunk in chunks], submitted
+
+    try:
+        chunks, submitted = asyncio.run(read_slowly())
+    finally:
+        pool.shutdown()
+
+    assert submitted == 3
+    assert len(chunks) == 10
+    # the crystal is pickled for the workers on the heavy lane, not the event loop
+    assert compute.compute_stats()["heavy"].completed == pickled + 1
+
+
+def test_streamed_scans_match_whole_scans(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    scans: List[Tuple[str, Dict[str, Any]]] = [
+        ("hkl", {"start": [1, 0, 1], "stop": [2, 0, 2], "inc": [0.5, 0, 0.5]}),
+        ("wavelength", {"start": 1, "stop": 2, "inc": 0.5}),
+        ("alpha", {"start": 1, "stop": 2, "inc": 0.5}),
+    ]
+    common = {"hkl": [1, 0, 1], "wavelength": 1}
+
+    for scan, params in scans:
+        url = f"/calculate/test/scan/{scan}"
+        whole = client.get(url, params={**common, **params}).json()["payload"]
+        streamed = client.get(url, params={**common, **params, "stream": True})
+
+        assert streamed.status_code == 200
+        assert streamed.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in streamed.text.splitlines()]
+        assert [line["payload"] for line in lines] == list(whole.values())
+
+    monkeypatch.setattr(hkl_service, "SCAN_PARALLEL_MIN_POINTS", 0)
+    monkeypatch.setattr(parallel, "SCAN_PROCESSES", 2)
+    monkeypatch.setattr(parallel, "SCAN_CHUNK_POINTS", 4)
+    try:
+        streamed = client.get(
+            "/calculate/test/scan/hkl", params={**common, **scans[0][1], "stream": 1}
+        )
+    finally:
+        parallel.shutdown_scan_pool()
+
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert [line["point"] for line in lines[:2]] == [[1.0, 0, 1.0], [1.0, 0, 1.5]]
+    assert len(lines) == 9
+
+
+def test_columnar_scans_hold_the_same_solutions(client: TestClient):
+    scans: List[Tuple[str, Dict[str, Any]]] = [
+        ("hkl", {"start": [1, 0, 1], "stop": [2, 0, 2], "inc": [0.5, 0, 0.5]}),
+        ("wavelength", {"start": 1, "stop": 2, "inc": 0.5}),
+        ("alpha", {"start": 1, "stop": 2, "inc": 0.5}),
+    ]
+    common = {"hkl": [1, 0, 1], "wavelength": 1}
+
+    for scan, params in scans:
+        url = f"/calculate/test/scan/{scan}"
+        by_point = client.get(url, params={**common, **params}).json()["payload"]
+        response = client.get(url, params={**common, **params, "format": "columnar"})
+
+        assert response.status_code == 200
+        columns = response.json()["payload"]
+        solutions = [s for point in by_point.values() for s in point]
+        assert len(columns["point"]) == len(solutions)
+        for name, values in solutions[0].items():
+            assert columns[name] == [solution[name] for solution in solutions]
+
+    hkl_columns = client.get(
+        "/calculate/test/scan/hkl",
+        params={**common, **scans[0][1], "format": "columnar"},
+    ).json()["payload"]
+    assert hkl_columns["scan_h"] == [1, 1, 1, 1.5, 1.5, 1.5, 2, 2, 2]
+    assert hkl_columns["scan_k"] == [0] * 9
+
+
+def test_scans_and_batches_negotiate_npz(client: TestClient):
+    npz = {"accept": "application/x-npz"}
+    params = {"start": [1, 0, 1], "stop": [2, 0, 2], "inc": [0.5, 0, 0.5]}
+    params = {**params, "wavelength": 1}
+
+    columns = client.get(
+        "/calculate/test/scan/hkl", params={**params, "format": "columnar"}
+    ).json()["payload"]
+    response = client.get("/calculate/test/scan/hkl", params=params, headers=npz)
+
+    assert response.headers["content-type"] == "application/x-npz"
+    arrays = np.load(io.BytesIO(response.content))
+    assert sorted(arrays.files) == sorted(columns)
+    for name, values in columns.items():
+        assert arrays[name].tolist() == values
+    assert arrays["mu"].dtype == np.float64
+
+    positions = [[7.31, 0, 10.62, 0, 0, 0], [7.31, 0, 10.62, 0, 0, 5]]
+    hkl = client.post(
+        "/calculate/test/position/hkl/batch",
+        json={"positions": positions, "wavelength": 1.0},
+        headers=npz,
+    )
+    arrays = np.load(io.BytesIO(hkl.content))
+    assert arrays.files == ["h", "k", "l"]
+    assert len(arrays["h"]) == 2
+
+    entries = [
+        {"miller_indices": [1, 0, 1], "wavelength": 1.0},
+        {"miller_indices": [0, 0, 0], "wavelength": 1.0},
+    ]
+    lab = client.post(
+        "/calculate/test/position/lab/batch", json={"entries": entries}, headers=npz
+    )
+    arrays = np.load(io.BytesIO(lab.content))
+    assert arrays["status_code"].tolist() == [200, 400]
+    assert set(arrays["point"]) == {0}
+    assert arrays["h"].tolist() == [1, 0]
+
+
+def test_streamed_scan_validates_before_streaming(client: TestClient):
+    response = client.get(
+        "/calculate/test/scan/hkl",
+        params={
+            "start": [0, 0, 0],
+            "stop": [1, 0, 1],
+            "inc": [0.5, 0, 0.5],
+            "wavelength": 1,
+            "stream": True,
+        },
+    )
+
+    assert response.status_code == Codes.CHECK_VALID_MILLER_INDICES
+
+
 def test_scan_wavelength(
     client: TestClient,
 ):
@@ -168,3 +364,372 @@ def test_calc_ub_fails_when_incorrect_tags(client: TestClient):
     )
 
     assert response.status_code == Codes.CALCULATE_UB_MATRIX
+
+
+def test_lab_position_batch_reports_errors_per_entry(client: TestClient):
+    response = client.post(
+        "/calculate/test/position/lab/batch",
+        json={
+            "entries": [
+                {"miller_indices": [0, 0, 1], "wavelength": 1},
+                {"miller_indices": [0, 0, 0], "wavelength": 1},
+                {"miller_indices": [1, 0, 1], "wavelength": 1},
+            ]
+        },
+    )
+    single = client.get(
+        "/calculate/test/position/lab",
+        params={"miller_indices": [1, 0, 1], "wavelength": 1},
+    )
+
+    assert response.status_code == 200
+    first, second, third = response.json()["payload"]
+
+    assert first["status_code"] == 200 and len(first["payload"]) > 0
+    assert second["status_code"] == Codes.CHECK_VALID_MILLER_INDICES
+    assert "payload" not in second
+    assert third["payload"] == single.json()["payload"]
+
+
+def test_vectorised_miller_indices_agree_with_get_hkl():
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-180, 180, (200, 6))
+    wavelengths = rng.uniform(0.5, 2, 200)
+
+    vectorised = miller_indices_from_lab_positions(
+        dummy_hkl.ubcalc.UB, positions, wavelengths
+    )
+    expected = [
+        dummy_hkl.get_hkl(Position(*pos), wavelength)
+        for pos, wavelength in zip(positions, wavelengths)
+    ]
+
+    assert np.allclose(vectorised, expected, rtol=0, atol=1e-12)
+
+
+def test_miller_indices_batch(client: TestClient):
+    positions = [[7.31, 0, 10.62, 0, 0, 0], [7.31, 0, 10.62, 0, 5, 0]]
+    response = client.post(
+        "/calculate/test/position/hkl/batch",
+        json={"positions": positions, "wavelength": 1},
+    )
+    single = client.get(
+        "/calculate/test/position/hkl", params={"pos": positions[1], "wavelength": 1}
+    )
+
+    assert response.status_code == 200
+    assert len(response.json()["payload"]) == 2
+    assert np.allclose(response.json()["payload"][1], single.json()["payload"])
+
+    mismatched = client.post(
+        "/calculate/test/position/hkl/batch",
+        json={"positions": positions, "wavelength": [1, 1, 1]},
+    )
+    assert mismatched.status_code == Codes.CHECK_VALID_WAVELENGTHS
+
+
+@pytest.mark.parametrize(
+    "media_type,body",
+    [
+        (
+            "text/csv",
+            "phi,chi,eta,nu,delta,mu\n0,0,0,10.62,0,7.31\n0,5,0,10.62,0,7.31\n",
+        ),
+        ("application/x-ndjson", "[7.31,0,10.62,0,0,0]\n[7.31,0,10.62,0,5,0]\n"),
+    ],
+)
+def test_trajectory_is_streamed_to_miller_indices(
+    client: TestClient, media_type: str, body: str
+):
+    response = client.post(
+        "/calculate/test/position/hkl/stream",
+        params={"wavelength": 1},
+        data=body,
+        headers={"content-type": media_type},
+    )
+    expected = client.post(
+        "/calculate/test/position/hkl/batch",
+        json={
+            "positions": [[7.31, 0, 10.62, 0, 0, 0], [7.31, 0, 10.62, 0, 5, 0]],
+            "wavelength": 1,
+        },
+    ).json()["payload"]
+
+    lines = response.text.splitlines()
+    if media_type == "text/csv":
+        assert lines.pop(0) == "h,k,l"
+        rows = [[float(value) for value in line.split(",")] for line in lines]
+    else:
+        rows = [json.loads(line) for line in lines]
+
+    assert response.status_code == 200
+    assert np.allclose(rows, expected, rtol=0, atol=1e-12)
+
+
+def test_trajectory_stream_reports_bad_rows_and_formats(client: TestClient):
+    response = client.post(
+        "/calculate/test/position/hkl/stream",
+        params={"wavelength": 1},
+        data="[7.31,0,10.62,0,0,0]\n[1,2]\n",
+        headers={"content-type": "application/x-ndjson"},
+    )
+    converted, error = map(json.loads, response.text.splitlines())
+    assert len(converted) == 3
+    assert error["error"].startswith("row 2:")
+
+    # the rows before a bad one are converted, and the header is not a row
+    csv = client.post(
+        "/calculate/test/position/hkl/stream",
+        params={"wavelength": 1},
+        data="mu,delta,nu,eta,chi,phi\n7.31,0,10.62,0,0,0\n7.31,0,10.62,0,5,0\n1,2\n",
+        headers={"content-type": "text/csv"},
+    )
+    lines = csv.text.splitlines()
+    assert len(lines) == 4
+    assert lines[0] == "h,k,l"
+    assert lines[3].startswith("# error: row 3:")
+
+    unsupported = client.post(
+        "/calculate/test/position/hkl/stream",
+        params={"wavelength": 1},
+        data="<xml/>",
+        headers={"content-type": "application/xml"},
+    )
+    assert unsupported.status_code == Codes.CHECK_TRAJECTORY_FORMAT
+
+
+def test_compute_dispatcher_bounds_calculations_and_keeps_loop_responsive():
+    dispatcher = ComputeDispatcher(workers=2, max_concurrency=1)
+    lock = threading.Lock()
+    running = []
+    overlapping = []
+
+    def calculation(seconds: float) -> float:
+        with lock:
+            running.append(None)
+            overlapping.append(len(running))
+        time.sleep(seconds)
+        with lock:
+            running.pop()
+        return seconds
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        results = await asyncio.gather(
+            dispatcher.run(calculation, 0.1), dispatcher.run(calculation, 0.1)
+        )
+        ticking.cancel()
+        return results, ticks
+
+    try:
+        results, ticks = asyncio.run(main())
+    finally:
+        dispatcher.shutdown()
+
+    assert results == [0.1, 0.1]
+    assert max(overlapping) == 1
+    assert ticks >= 10
+
+    stats = dispatcher.stats
+    assert (stats.completed, stats.running, stats.queued) == (2, 0, 0)
+    assert stats.peak_queued == 1
+    assert stats.total_wait > 0
+
+
+def test_light_calculations_do_not_wait_for_heavy_ones(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(
+        compute,
+        "_dispatchers",
+        {"light": ComputeDispatcher(1, 1), "heavy": ComputeDispatcher(1, 1)},
+    )
+
+    async def main():
+        heavy = [
+            asyncio.create_task(compute.run_heavy_compute(time.sleep, 0.3))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0.05)
+
+        started = time.perf_counter()
+        await compute.run_compute(lambda: None)
+        waited = time.perf_counter() - started
+
+        await asyncio.gather(*heavy)
+        return waited
+
+    try:
+        waited = asyncio.run(main())
+    finally:
+        compute.shutdown_dispatcher()
+
+    assert waited < 0.1
+
+
+def test_numpy_json_encoders_agree():
+    content = {
+        "payload": {
+            "point": np.arange(3),
+            "mu": np.array([0.1, 2.5, -3.0]),
+            "columns": np.ones((3, 2))[:, 0],
+            "scalars": (np.float64(1.5), np.int64(2), np.bool_(True)),
+            "unsolved": np.array([np.nan, np.inf]),
+            "nan": float("nan"),
+        }
+    }
+    expected = {
+        "payload": {
+            "point": [0, 1, 2],
+            "mu": [0.1, 2.5, -3.0],
+            "columns": [1.0, 1.0, 1.0],
+            "scalars": [1.5, 2, True],
+            "unsolved": [None, None],
+            "nan": None,
+        }
+    }
+
+    assert json.loads(responses.dumps_stdlib(content)) == expected
+    if responses.orjson is not None:
+        assert json.loads(responses.dumps_orjson(content)) == expected
+
+
+def test_position_cache_is_keyed_on_crystal_state(tmp_path):
+    hklcalc = pickle.loads(pickle.dumps(dummy_hkl))
+    cache = PositionCache(max_entries=2, database=tmp_path / "positions.sqlite")
+
+    first = cache.get_position(hklcalc, (1, 0, 1), 1.0)
+    assert first == cache.get_position(hklcalc, (1.0, 0.0, 1.0), 1)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    hklcalc.constraints = Constraints({"qaz": 0, "alpha": 0, "eta": 10})
+    changed = cache.get_position(hklcalc, (1, 0, 1), 1.0)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert changed != first
+
+    cache.get_position(hklcalc, (0, 0, 1), 1.0)
+    assert len(cache) == 2
+    cache.close()
+
+    restarted = PositionCache(database=tmp_path / "positions.sqlite")
+    assert restarted.get_position(hklcalc, (1, 0, 1), 1.0) == changed
+    assert (restarted.hits, restarted.misses) == (1, 0)
+
+    hklcalc.ubcalc.set_lattice("SiO2", 4.913, 6.0)
+    with pytest.raises(DiffcalcException):
+        restarted.get_position(hklcalc, (1, 0, 1), 1.0)
+    restarted.close()
+
+
+def test_scans_write_new_positions_to_disk_in_one_transaction(
+    tmp_path, monkeypatch: pytest.MonkeyPatch
+):
+    cache = PositionCache(database=tmp_path / "positions.sqlite")
+    monkeypatch.setattr(memo, "_cache", cache)
+    writes: List[int] = []
+    put_many = DiskTier.put_many
+
+    def counting_put_many(self, items):
+        writes.append(len(items))
+        put_many(self, items)
+
+    monkeypatch.setattr(DiskTier, "put_many", counting_put_many)
+
+    points = [(1, 0, 1), (1, 0, 1.5), (1.5, 0, 1)]
+    solutions = hkl_service.solve_points(dummy_hkl, points, 1)
+    hkl_service.solve_point(dummy_hkl, (0, 0, 1), 1)
+    cache.close()
+
+    assert writes == [3, 1]
+    restarted = PositionCache(database=tmp_path / "positions.sqlite")
+    assert [
+        restarted.get_position(dummy_hkl, point, 1) for point in points
+    ] == solutions
+    assert restarted.misses == 0
+    restarted.close()
+
+
+def test_identical_concurrent_calculations_are_coalesced():
+    class CountingStore(FakeHklCalcStore):
+        loads = 0
+
+        async def load(self, name: str) -> HklCalculation:
+            self.loads += 1
+            await asyncio.sleep(0.01)
+            return await super().load(name)
+
+    store = CountingStore(dummy_hkl)
+    flights = get_single_flight()
+
+    async def main():
+        first = await asyncio.gather(
+            hkl_service.lab_position_from_miller_indices("test", (1, 0, 1), 1, store),
+            hkl_service.lab_position_from_miller_indices(
+                "test", [1.0, 0.0, 1.0], 1.0, store
+            ),
+            hkl_service.lab_position_from_miller_indices("test", (0, 0, 1), 1, store),
+        )
+        await store.save("test", dummy_hkl)
+        second = await hkl_service.lab_position_from_miller_indices(
+            "test", (1, 0, 1), 1, store
+        )
+        return first, second
+
+    coalesced = flights.coalesced
+    (same, again, other), after_save = asyncio.run(main())
+
+    assert same is again
+    assert other != same
+    assert after_save == same
+    assert store.loads == 3
+    assert flights.coalesced == coalesced + 1
+
+
+def test_live_session_reloads_only_when_state_changes():
+    class CountingStore(FakeHklCalcStore):
+        loads = 0
+
+        async def load(self, name: str) -> HklCalculation:
+            self.loads += 1
+            return await super().load(name)
+
+    store = CountingStore(dummy_hkl)
+    positions = [[7.31, 0, 10.62, 0, 0, 0], [7.31, 0, 10.62, 0, 5, 0]]
+    expected = miller_indices_from_lab_positions(dummy_hkl.ubcalc.UB, positions, 1)
+
+    previous = app.dependency_overrides.get(get_store)
+    app.dependency_overrides[get_store] = lambda: store
+    try:
+        with TestClient(app).websocket_connect(
+            "/calculate/test/position/hkl/live"
+        ) as websocket:
+            for i, pos in enumerate(positions * 3):
+                websocket.send_json({"pos": pos, "wavelength": 1, "id": i})
+                reply = websocket.receive_json()
+                assert reply["status_code"] == 200
+                assert reply["id"] == i
+                assert np.allclose(reply["payload"], expected[i % 2])
+            assert store.loads == 1
+
+            websocket.send_text("not a position")
+            assert websocket.receive_json()["status_code"] == 422
+            websocket.send_json({"pos": positions[0], "wavelength": -1})
+            reply = websocket.receive_json()
+            assert reply["status_code"] == Codes.CHECK_VALID_WAVELENGTHS
+
+            asyncio.run(store.save("test", dummy_hkl))
+            websocket.send_json({"pos": positions[0], "wavelength": 1})
+            reply = websocket.receive_json()
+            assert reply["status_code"] == 200
+            assert reply["version"] == store.versions.get("test")
+            assert store.loads == 2
+    finally:
+        app.dependency_overrides[get_store] = previous
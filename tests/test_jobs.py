@@ -0,0 +1,141 @@
+import threading
+import time
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from diffcalc_API.errors.definitions import DiffcalcAPIException
+from diffcalc_API.errors.jobs import Codes
+from diffcalc_API.server import app
+from diffcalc_API.services import jobs
+from diffcalc_API.services.jobs import Job, JobQueue, JobStatus
+from diffcalc_API.services.scans import ScanResult
+from diffcalc_API.stores.factory import get_store
+from tests.test_hklcalc import dummy_get_store
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> Iterator[TestClient]:
+    app.dependency_overrides[get_store] = dummy_get_store
+    queue = JobQueue(processes=0, chunk_points=2)
+    monkeypatch.setattr(jobs, "_queue", queue)
+
+    yield TestClient(app)
+
+    queue.shutdown()
+
+
+def wait_for(client: TestClient, job_id: str) -> dict:
+    for _ in range(500):
+        job = client.get(f"/jobs/{job_id}").json()["payload"]
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_scan_job_results_match_scan(client: TestClient):
+    params = {"start": [1, 0, 1], "stop": [2, 0, 2], "inc": [0.5, 0, 0.5]}
+    scan = client.get("/calculate/test/scan/hkl", params={**params, "wavelength": 1})
+
+    submitted = client.post("/jobs/test/scan/hkl", params={**params, "wavelength": 1})
+    assert submitted.status_code == 202
+    job_id = submitted.json()["payload"]["id"]
+
+    job = wait_for(client, job_id)
+    assert job["status"] == "finished"
+    assert job["done"] == job["total"] == 9
+
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.json()["payload"] == scan.json()["payload"]
+
+    columnar = client.get(f"/jobs/{job_id}/result", params={"format": "columnar"})
+    assert len(columnar.json()["payload"]["scan_h"]) == 9
+
+    # cancelling a job that has ended changes nothing
+    assert client.delete(f"/jobs/{job_id}").json()["payload"]["status"] == "finished"
+
+    assert client.get("/jobs/unknown").status_code == Codes.CHECK_JOB_EXISTS
+    invalid = client.post(
+        "/jobs/test/scan/hkl", params={**params, "wavelength": 1, "stop": [0, 0, 0]}
+    )
+    assert invalid.status_code == 400
+
+
+def test_job_queue_limits_running_jobs_and_expires_results():
+    queue = JobQueue(
+        max_running=2, max_running_per_crystal=1, processes=0, result_ttl=0.2
+    )
+    release = threading.Event()
+
+    def work(job: Job) -> ScanResult:
+        release.wait(5)
+        return ScanResult({}, [], [])
+
+    try:
+        first = queue.submit("a", 1, 1, work)
+        second = queue.submit("a", 1, 1, work)
+        other = queue.submit("b", 1, 1, work)
+        last = queue.submit("c", 1, 1, work)
+
+        assert [job.status for job in (first, second, other, last)] == [
+            JobStatus.running,
+            JobStatus.queued,
+            JobStatus.running,
+            JobStatus.queued,
+        ]
+
+        queue.cancel(second.id)
+        assert second.status == JobStatus.cancelled
+
+        release.set()
+        for _ in range(500):
+            if queue.get(last.id).status == JobStatus.finished:
+                break
+            time.sleep(0.01)
+
+        assert first.status == other.status == last.status == JobStatus.finished
+        assert second.done == 0
+
+        time.sleep(0.2)
+        with pytest.raises(DiffcalcAPIException) as error:
+            queue.get(first.id)
+        assert error.value.status_code == Codes.CHECK_JOB_EXISTS
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_running_jobs_stop_when_cancelled(client: TestClient):
+    queue = jobs.get_job_queue()
+    started = threading.Event()
+    solve = queue.solve
+
+    def slow_solve(job, crystal, points, wavelength):
+        started.set()
+        while job.status == JobStatus.running:
+            time.sleep(0.01)
+        return solve(job, crystal, points, wavelength)
+
+    queue.solve = slow_solve  # type: ignore
+    submitted = client.post(
+        "/jobs/test/scan/hkl",
+        params={
+            "start": [1, 0, 1],
+            "stop": [2, 0, 2],
+            "inc": [0.5, 0, 0.5],
+            "wavelength": 1,
+        },
+    )
+    job_id = submitted.json()["payload"]["id"]
+    assert started.wait(5)
+
+    assert client.delete(f"/jobs/{job_id}").json()["payload"]["status"] == "cancelled"
+    job = wait_for(client, job_id)
+    assert job["status"] == "cancelled"
+    assert job["done"] == 0
+
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == Codes.CHECK_JOB_FINISHED
@@ -0,0 +1,749 @@
+import asyncio
+import json
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+import pytest
+from diffcalc.hkl.calc import HklCalculation
+from diffcalc.hkl.constraints import Constraints
+from diffcalc.hkl.geometry import Position
+from diffcalc.ub.calc import UBCalculation
+from fastapi.testclient import TestClient
+from pytest import MonkeyPatch
+
+from diffcalc_API.errors.definitions import DiffcalcAPIException
+from diffcalc_API.server import app
+from diffcalc_API.services import constraints as service
+from diffcalc_API.services import events
+from diffcalc_API.stores import factory, pickling
+from diffcalc_API.stores.base import BaseHklCalcStore
+from diffcalc_API.stores.cache import LRUCache
+from diffcalc_API.stores.compact import CompactHklCalcStore
+from diffcalc_API.stores.journal import JournalHklCalcStore, read_records
+from diffcalc_API.stores.memory import InMemoryHklCalcStore
+from diffcalc_API.stores.migrate import migrate_folder
+from diffcalc_API.stores.pickling import PicklingHklCalcStore
+from diffcalc_API.stores.serialization import decode, encode, is_encoded, to_dict
+from diffcalc_API.stores.sqlite import Codes as SqliteCodes
+from diffcalc_API.stores.sqlite import SqliteHklCalcStore
+from diffcalc_API.stores.versions import token_tag
+
+
+def test_lru_cache_evicts_least_recently_used_entry():
+    cache: LRUCache[str] = LRUCache(max_entries=2, max_bytes=100)
+    cache.put("a", "A", 10)
+    cache.put("b", "B", 10)
+    assert cache.get("a") == "A"
+
+    cache.put("c", "C", 10)
+
+    assert "b" not in cache
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+    assert cache.stats.evictions == 1
+
+
+def test_lru_cache_respects_byte_limit_and_stamps():
+    cache: LRUCache[str] = LRUCache(max_entries=10, max_bytes=25)
+    cache.put("a", "A", 10, stamp=1)
+    cache.put("b", "B", 10, stamp=1)
+    cache.put("c", "C", 10, stamp=1)
+
+    assert len(cache) == 2
+    assert cache.nbytes == 20
+    assert cache.get("b", stamp=2) is None
+    assert "b" not in cache
+    assert cache.stats.misses == 1
+
+
+def test_pickling_store_serves_hot_crystals_from_cache(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path)
+    hkl = HklCalculation(UBCalculation(name="test"), Constraints())
+
+    asyncio.run(store.save("test", hkl))
+    assert asyncio.run(store.load("test")) is hkl
+    assert store.cache.stats.hits == 1
+
+
+def test_store_cache_stats_are_reported(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path)
+    asyncio.run(store.create("test"))
+    asyncio.run(store.load("test"))
+
+    previous = app.dependency_overrides.get(factory.get_store)
+    app.dependency_overrides[factory.get_store] = lambda: store
+    try:
+        response = TestClient(app).get("/metrics/store")
+    finally:
+        app.dependency_overrides.pop(factory.get_store)
+        if previous is not None:
+            app.dependency_overrides[factory.get_store] = previous
+
+    payload = response.json()["payload"]
+    assert response.status_code == 200
+    assert (payload["hits"], payload["misses"], payload["evictions"]) == (1, 0, 0)
+    assert payload["entries"] == 1
+    assert payload["bytes"] == store.cache.nbytes > 0
+
+
+def test_pickling_store_reloads_when_file_changes(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path)
+    hkl = HklCalculation(UBCalculation(name="test"), Constraints())
+    asyncio.run(store.save("test", hkl))
+
+    other = HklCalculation(UBCalculation(name="other"), Constraints({"mu": 1}))
+    with open(tmp_path / "test", "wb") as stream:
+        pickle.dump(other, stream)
+    os.utime(tmp_path / "test", ns=(0, 0))
+
+    loaded = asyncio.run(store.load("test"))
+    assert loaded is not hkl
+    assert loaded.ubcalc.name == "other"
+    assert store.cache.stats.misses == 1
+
+
+def test_pickling_store_runs_concurrent_loads_on_io_pool(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path, cache_max_entries=0, io_workers=2)
+    names = ["first", "second"]
+
+    async def save_then_load_all():
+        for name in names:
+            await store.save(name, HklCalculation(UBCalculation(name), Constraints()))
+        loaded = await asyncio.gather(*(store.load(name) for name in names))
+        await store.close()
+        return loaded
+
+    loaded = asyncio.run(save_then_load_all())
+
+    assert [hkl.ubcalc.name for hkl in loaded] == names
+
+
+def test_get_store_hands_out_one_shared_instance(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+):
+    monkeypatch.setattr(factory, "SAVE_PICKLES_FOLDER", str(tmp_path))
+    factory.setup_store()
+
+    try:
+        assert factory.get_store() is factory.get_store()
+    finally:
+        asyncio.run(factory.teardown_store())
+
+
+@pytest.mark.parametrize("store_type", [PicklingHklCalcStore, JournalHklCalcStore])
+def test_index_is_rebuilt_on_startup_and_kept_current(tmp_path: Path, store_type: type):
+    asyncio.run(store_type(tmp_path).save("aligned", build_aligned_crystal()))
+    (tmp_path / "not_a_crystal").write_text("hello")
+
+    store = store_type(tmp_path)
+    store.rebuild_index()
+    info = store.index.get("aligned")
+
+    assert len(store.index) == 1
+    assert info.reflections == 1 and info.ub_calculated
+    assert info.size > 0
+
+    asyncio.run(store.create("empty"))
+    with pytest.raises(DiffcalcAPIException):
+        asyncio.run(store.create("empty"))
+    asyncio.run(store.delete("aligned"))
+
+    assert [info.name for info in store.index.page(0, 10)] == ["empty"]
+    assert store.index.get("empty").reflections == 0
+
+
+def test_stores_missing_a_storage_hook_cannot_be_constructed():
+    class LoadOnlyStore(BaseHklCalcStore):
+        def _load(self, name: str) -> HklCalculation:
+            return HklCalculation(UBCalculation(name), Constraints())
+
+    with pytest.raises(TypeError):
+        LoadOnlyStore()  # type: ignore[abstract]
+
+
+def test_crystals_are_listed_a_page_at_a_time():
+    store = InMemoryHklCalcStore()
+    for name in ["c", "a", "b"]:
+        asyncio.run(store.create(name))
+
+    previous = app.dependency_overrides.get(factory.get_store)
+    app.dependency_overrides[factory.get_store] = lambda: store
+    try:
+        response = TestClient(app).get("/", params={"offset": 1, "limit": 1})
+    finally:
+        app.dependency_overrides.pop(factory.get_store)
+        if previous is not None:
+            app.dependency_overrides[factory.get_store] = previous
+
+    payload = response.json()["payload"]
+    assert response.status_code == 200
+    assert payload["total"] == 3
+    assert [crystal["name"] for crystal in payload["crystals"]] == ["b"]
+
+
+def test_concurrent_edits_to_one_crystal_are_not_lost(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path, cache_max_entries=0)
+    properties = ["mu", "eta", "delta"]
+
+    async def constrain_concurrently():
+        await store.create("test")
+        await asyncio.gather(
+            *(service.set_constraint("test", p, 1, store) for p in properties)
+        )
+        return await store.load("test")
+
+    hkl = asyncio.run(constrain_concurrently())
+
+    assert set(hkl.constraints.asdict) == set(properties)
+
+
+def test_failed_saves_leave_the_loaded_crystal_untouched(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+):
+    store = PicklingHklCalcStore(tmp_path)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    async def edit_while_disk_is_full():
+        await store.create("test")
+        loaded = await store.load("test")
+        version = store.versions.get("test")
+
+        monkeypatch.setattr(pickling, "write_atomically", fail)
+        with pytest.raises(OSError):
+            await service.set_constraint("test", "mu", 1, store)
+
+        return loaded, await store.load("test"), version
+
+    loaded, after, version = asyncio.run(edit_while_disk_is_full())
+
+    assert after is loaded
+    assert after.constraints.asdict == {}
+    assert store.versions.get("test") == version
+
+
+@pytest.mark.parametrize("store_type", [PicklingHklCalcStore, JournalHklCalcStore])
+def test_stores_sharing_a_directory_see_each_others_edits(
+    tmp_path: Path, store_type: type
+):
+    # two stores on one directory stand in for two uvicorn worker processes
+    first, second = store_type(tmp_path), store_type(tmp_path)
+    properties = ["mu", "eta", "delta"]
+
+    async def constrain_from_both_stores():
+        await first.create("test")
+        await first.load("test")
+        await second.load("test")
+        await asyncio.gather(
+            *(
+                service.set_constraint("test", p, 1, (first, second)[i % 2])
+                for i, p in enumerate(properties)
+            )
+        )
+        return await first.load("test"), await second.load("test")
+
+    from_first, from_second = asyncio.run(constrain_from_both_stores())
+
+    assert set(from_first.constraints.asdict) == set(properties)
+    assert set(from_second.constraints.asdict) == set(properties)
+
+
+def test_only_one_store_sharing_a_directory_creates_a_crystal(tmp_path: Path):
+    first, second = PicklingHklCalcStore(tmp_path), PicklingHklCalcStore(tmp_path)
+
+    async def create_from_both_stores():
+        return await asyncio.gather(
+            first.create("test"), second.create("test"), return_exceptions=True
+        )
+
+    results = asyncio.run(create_from_both_stores())
+    errors = [result for result in results if result is not None]
+
+    assert len(errors) == 1
+    assert isinstance(errors[0], DiffcalcAPIException)
+    assert errors[0].status_code == 405
+
+
+@pytest.mark.parametrize(
+    "open_store",
+    [
+        PicklingHklCalcStore,
+        JournalHklCalcStore,
+        lambda path: SqliteHklCalcStore(path / "crystals.sqlite"),
+    ],
+)
+def test_stores_sharing_storage_see_each_others_creates_and_deletes(
+    tmp_path: Path, open_store: Callable[[Path], BaseHklCalcStore]
+):
+    first, second = open_store(tmp_path), open_store(tmp_path)
+
+    async def create_and_delete_from_first():
+        await first.create("deleted")
+        await second.load("deleted")
+        await first.delete("deleted")
+        await first.create("created")
+
+        await second.create("deleted")
+        await second.refresh_index()
+
+    asyncio.run(create_and_delete_from_first())
+
+    assert second.index.names() == ["created", "deleted"]
+    assert first.index.names() == ["created"]
+    asyncio.run(first.refresh_index())
+    assert first.index.names() == ["created", "deleted"]
+
+
+def test_rewrites_are_seen_even_when_the_file_stat_is_unchanged(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+):
+    # as for a same-size rewrite within one tick of a coarse timestamp
+    monkeypatch.setattr(pickling, "file_stamp", lambda file_path: (0, 0, 0))
+    first, second = PicklingHklCalcStore(tmp_path), PicklingHklCalcStore(tmp_path)
+
+    async def edit_from_first_and_load_from_second():
+        await first.create("test")
+        created = await second.state_tag("test")
+        await service.set_constraint("test", "mu", 1, first)
+        constrained = await second.load("test")
+        await service.set_constraint("test", "mu", 2, first)
+        return created, constrained, await second.load("test")
+
+    created, constrained, changed = asyncio.run(edit_from_first_and_load_from_second())
+
+    assert constrained.constraints.asdict == {"mu": 1}
+    assert changed.constraints.asdict == {"mu": 2}
+    assert created != asyncio.run(second.state_tag("test"))
+
+    asyncio.run(first.delete("test"))
+    assert not (tmp_path / ".generations" / "test").exists()
+
+
+@pytest.mark.parametrize("store_type", [PicklingHklCalcStore, JournalHklCalcStore])
+def test_lock_files_are_opened_on_io_pool_and_removed_on_delete(
+    tmp_path: Path, store_type: type
+):
+    store = store_type(tmp_path)
+    threads: List[int] = []
+    try_lock = store._try_lock
+
+    def recording_try_lock(name: str):
+        threads.append(threading.get_ident())
+        return try_lock(name)
+
+    store._try_lock = recording_try_lock
+
+    async def edit_then_delete():
+        await store.create("test")
+        async with store.lock("test"):
+            assert (tmp_path / ".locks" / "test").exists()
+        await store.delete("test")
+        await store.close()
+
+    asyncio.run(edit_then_delete())
+
+    assert threads and threading.get_ident() not in threads
+    assert not (tmp_path / ".locks" / "test").exists()
+
+
+def test_write_behind_coalesces_bursts_into_one_write(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+):
+    store = PicklingHklCalcStore(tmp_path, write_behind_delay=0.5)
+    writes: List[None] = []
+    save = store._save
+    monkeypatch.setattr(store, "_save", lambda *args: writes.append(save(*args)))
+
+    async def edit_repeatedly():
+        await store.create("test")
+        for value in range(50):
+            await service.set_constraint("test", "mu", value, store)
+        await asyncio.sleep(0.6)
+        await store.close()
+
+    asyncio.run(edit_repeatedly())
+
+    with open(tmp_path / "test", "rb") as stream:
+        assert pickle.load(stream).constraints.asdict == {"mu": 49}
+    assert len(writes) == 1
+
+
+def test_failed_write_behind_flushes_keep_the_edit_and_retry(
+    tmp_path: Path, monkeypatch: MonkeyPatch, caplog: pytest.LogCaptureFixture
+):
+    store = PicklingHklCalcStore(tmp_path, write_behind_delay=0.05)
+    attempts: List[None] = []
+    save = store._save
+
+    def fail_first_write(name: str, calc: HklCalculation) -> None:
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise OSError("disk full")
+        save(name, calc)
+
+    monkeypatch.setattr(store, "_save", fail_first_write)
+
+    async def edit_then_wait_for_retry():
+        await store.create("test")
+        await service.set_constraint("test", "mu", 1, store)
+        for _ in range(100):
+            if len(attempts) > 1:
+                break
+            await asyncio.sleep(0.05)
+        await store.close()
+
+    asyncio.run(edit_then_wait_for_retry())
+
+    assert len(attempts) == 2
+    assert "disk full" in caplog.text
+    with open(tmp_path / "test", "rb") as stream:
+        assert pickle.load(stream).constraints.asdict == {"mu": 1}
+
+
+def test_flush_keeps_crystals_that_fail_to_write(
+    tmp_path: Path, monkeypatch: MonkeyPatch
+):
+    store = PicklingHklCalcStore(tmp_path, write_behind_delay=60)
+    save = store._save
+
+    def fail(name: str, calc: HklCalculation) -> None:
+        raise OSError("disk full")
+
+    async def edit_then_flush():
+        await store.create("test")
+        await service.set_constraint("test", "mu", 1, store)
+
+        monkeypatch.setattr(store, "_save", fail)
+        with pytest.raises(OSError):
+            await store.flush()
+        assert "test" in store._pending
+
+        monkeypatch.setattr(store, "_save", save)
+        await store.close()
+
+    asyncio.run(edit_then_flush())
+
+    assert store._pending == {}
+    with open(tmp_path / "test", "rb") as stream:
+        assert pickle.load(stream).constraints.asdict == {"mu": 1}
+
+
+def test_journal_store_appends_only_changed_sections(tmp_path: Path):
+    store = JournalHklCalcStore(tmp_path, cache_max_entries=0)
+
+    async def create_then_edit():
+        await store.create("test")
+        await service.set_constraint("test", "mu", 1, store)
+        await service.set_constraint("test", "eta", 2, store)
+
+    asyncio.run(create_then_edit())
+    with open(tmp_path / "test.journal", "rb") as stream:
+        records = [record for record, _ in read_records(stream)]
+
+    assert [list(record) for record in records] == [["constraints"], ["constraints"]]
+
+    reloaded = JournalHklCalcStore(tmp_path)
+    hkl = asyncio.run(reloaded.load("test"))
+    assert hkl.constraints.asdict == {"mu": 1, "eta": 2}
+    assert hkl.ubcalc.name == "test"
+
+
+def test_journal_store_compacts_and_ignores_torn_records(tmp_path: Path):
+    store = JournalHklCalcStore(tmp_path, cache_max_entries=0, compact_ops=3)
+
+    async def edit(values):
+        for value in values:
+            await service.set_constraint("test", "mu", value, store)
+
+    asyncio.run(store.create("test"))
+    asyncio.run(edit(range(3)))
+    assert not (tmp_path / "test.journal").exists()
+
+    asyncio.run(edit([10]))
+    with open(tmp_path / "test.journal", "ab") as stream:
+        stream.write(b"\x10\x00\x00\x00torn")
+
+    hkl = asyncio.run(JournalHklCalcStore(tmp_path).load("test"))
+    assert hkl.constraints.asdict == {"mu": 10}
+
+    # the compacted snapshot is still a crystal to the other stores
+    snapshot = asyncio.run(PicklingHklCalcStore(tmp_path).load("test"))
+    assert snapshot.constraints.asdict == {"mu": 2}
+
+
+def build_aligned_crystal() -> HklCalculation:
+    hkl = HklCalculation(UBCalculation(name="sixcircle"), Constraints())
+    hkl.ubcalc.set_lattice("SiO2", 4.913, 5.405)
+    hkl.ubcalc.n_hkl = (1, 0, 0)
+    hkl.ubcalc.add_reflection(
+        (0, 0, 1), Position(7.31, 0, 10.62, 0, 0, 0), 12.39842, "refl1"
+    )
+    hkl.ubcalc.add_orientation((0, 1, 0), (0, 1, 0), None, "plane")
+    hkl.ubcalc.calc_ub("refl1", "plane")
+    hkl.constraints = Constraints({"qaz": 0, "alpha": 0, "eta": 0})
+    return hkl
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "lzma"])
+def test_compact_encoding_round_trips_crystal_state(compression: str):
+    hkl = build_aligned_crystal()
+    decoded = decode(encode(hkl, compression))
+
+    assert to_dict(decoded) == to_dict(hkl)
+    assert np.allclose(decoded.ubcalc.UB, hkl.ubcalc.UB)
+    assert np.allclose(
+        decoded.get_hkl(Position(7.31, 0, 10.62, 0, 0, 0), 1.0),
+        hkl.get_hkl(Position(7.31, 0, 10.62, 0, 0, 0), 1.0),
+    )
+
+
+def test_compact_store_reads_and_migrates_existing_pickles(tmp_path: Path):
+    with open(tmp_path / "test", "wb") as stream:
+        pickle.dump(build_aligned_crystal(), stream)
+
+    store = CompactHklCalcStore(tmp_path, cache_max_entries=0)
+    assert asyncio.run(store.load("test")).ubcalc.name == "sixcircle"
+
+    assert migrate_folder(tmp_path, "zlib") == [tmp_path / "test"]
+    assert is_encoded((tmp_path / "test").read_bytes())
+    assert migrate_folder(tmp_path, "zlib") == []
+    assert asyncio.run(store.load("test")).constraints.asdict == {
+        "qaz": 0,
+        "alpha": 0,
+        "eta": 0,
+    }
+
+
+def test_sqlite_store_round_trips_crystals(tmp_path: Path):
+    store = SqliteHklCalcStore(tmp_path / "crystals.sqlite", cache_max_entries=0)
+
+    async def create_edit_delete():
+        await store.create("test")
+        with pytest.raises(DiffcalcAPIException):
+            await store.create("test")
+
+        await service.set_constraint("test", "mu", 1, store)
+        constraints = (await store.load("test")).constraints.asdict
+
+        await store.delete("test")
+        with pytest.raises(DiffcalcAPIException):
+            await store.load("test")
+        await store.close()
+        return constraints
+
+    assert asyncio.run(create_edit_delete()) == {"mu": 1}
+
+
+def test_sqlite_store_rejects_saves_of_stale_versions(tmp_path: Path):
+    database = tmp_path / "crystals.sqlite"
+    first = SqliteHklCalcStore(database, cache_max_entries=0)
+    second = SqliteHklCalcStore(database, cache_max_entries=0)
+
+    async def conflicting_saves():
+        await first.create("test")
+        ours, theirs = await first.load("test"), await second.load("test")
+        await second.save("test", theirs)
+        try:
+            await first.save("test", ours)
+        finally:
+            await first.close()
+            await second.close()
+
+    with pytest.raises(DiffcalcAPIException) as conflict:
+        asyncio.run(conflicting_saves())
+
+    assert conflict.value.status_code == SqliteCodes.check_version
+
+
+def test_sqlite_store_tells_recreated_crystals_apart(tmp_path: Path):
+    database = tmp_path / "crystals.sqlite"
+    first = SqliteHklCalcStore(database)
+    second = SqliteHklCalcStore(database)
+
+    async def recreate_elsewhere():
+        await first.create("test")
+        await service.set_constraint("test", "mu", 1, first)
+        stale = await first.load("test")
+
+        # as many saves as the first crystal had, so row versions could repeat
+        await second.delete("test")
+        await second.create("test")
+        await service.set_constraint("test", "eta", 2, second)
+
+        loaded = await first.load("test")
+        with pytest.raises(DiffcalcAPIException) as conflict:
+            await first.save("test", stale)
+
+        await first.close()
+        await second.close()
+        return loaded, conflict.value
+
+    loaded, conflict = asyncio.run(recreate_elsewhere())
+
+    assert loaded.constraints.asdict == {"eta": 2}
+    assert conflict.status_code == SqliteCodes.check_version
+
+
+def test_memory_store_snapshots_and_restores_crystals(tmp_path: Path):
+    store = InMemoryHklCalcStore(tmp_path, snapshot_interval=0.01)
+
+    async def create_edit_wait():
+        await store.create("test")
+        await store.create("removed")
+        await service.set_constraint("test", "mu", 1, store)
+        await store.delete("removed")
+        hkl = await store.load("test")
+        await asyncio.sleep(0.1)
+        return hkl
+
+    hkl = asyncio.run(create_edit_wait())
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["test"]
+    restored = InMemoryHklCalcStore(tmp_path)
+    assert asyncio.run(restored.load("test")).constraints.asdict == {"mu": 1}
+
+    hkl.constraints = Constraints({"eta": 2})
+    asyncio.run(store.save("test", hkl))
+    asyncio.run(store.close())
+
+    restored = InMemoryHklCalcStore(tmp_path)
+    assert asyncio.run(restored.load("test")).constraints.asdict == {"eta": 2}
+
+
+def test_memory_store_skips_files_that_are_not_crystals(tmp_path: Path):
+    journal = JournalHklCalcStore(tmp_path)
+    asyncio.run(journal.create("journalled"))
+    asyncio.run(service.set_constraint("journalled", "mu", 1, journal))
+    compacted = JournalHklCalcStore(tmp_path, compact_ops=1)
+    asyncio.run(compacted.create("compacted"))
+    asyncio.run(service.set_constraint("compacted", "mu", 1, compacted))
+    asyncio.run(service.set_constraint("compacted", "mu", 2, compacted))
+    asyncio.run(PicklingHklCalcStore(tmp_path).create("pickled"))
+    (tmp_path / "notes.txt").write_text("not a crystal")
+    # as journal snapshots were written before they were pickled crystals
+    (tmp_path / "sections").write_bytes(pickle.dumps({"constraints": b""}))
+
+    store = InMemoryHklCalcStore(tmp_path)
+
+    assert store.index.names() == ["compacted", "pickled"]
+
+
+@pytest.mark.parametrize(
+    "store_type", [PicklingHklCalcStore, SqliteHklCalcStore, InMemoryHklCalcStore]
+)
+def test_every_change_bumps_the_state_version(tmp_path: Path, store_type: type):
+    path = (
+        tmp_path / "crystals.sqlite" if store_type is SqliteHklCalcStore else tmp_path
+    )
+    store = store_type(path)
+    versions = []
+
+    async def change():
+        versions.append(store.versions.get("test"))
+        await store.create("test")
+        versions.append(store.versions.get("test"))
+        await store.load("test")
+        versions.append(store.versions.get("test"))
+        await service.set_constraint("test", "mu", 1, store)
+        versions.append(store.versions.get("test"))
+        await store.delete("test")
+        versions.append(store.versions.get("test"))
+        await store.create("test")
+        versions.append(store.versions.get("test"))
+        await store.close()
+
+    asyncio.run(change())
+
+    assert versions[0] == 0
+    assert 0 < versions[1] == versions[2] < versions[3] < versions[4] < versions[5]
+
+
+def test_conditional_gets_are_answered_until_the_crystal_changes(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path)
+    other_process = PicklingHklCalcStore(tmp_path)
+    asyncio.run(store.create("test"))
+
+    previous = app.dependency_overrides.get(factory.get_store)
+    app.dependency_overrides[factory.get_store] = lambda: store
+    try:
+        client = TestClient(app)
+        first = client.get("/constraints/test")
+        etag = first.headers["etag"]
+        unchanged = client.get("/constraints/test", headers={"if-none-match": etag})
+
+        client.put("/constraints/test/set", json={"mu": 1, "eta": 0, "delta": 0})
+        edited = client.get("/constraints/test", headers={"if-none-match": etag})
+
+        asyncio.run(service.set_constraint("test", "mu", 2, other_process))
+        elsewhere = client.get(
+            "/constraints/test", headers={"if-none-match": edited.headers["etag"]}
+        )
+        ub = client.get("/ub/test")
+
+        # another worker, or this one after a restart, tags the same state the same
+        app.dependency_overrides[factory.get_store] = lambda: PicklingHklCalcStore(
+            tmp_path
+        )
+        restarted = client.get(
+            "/constraints/test", headers={"if-none-match": elsewhere.headers["etag"]}
+        )
+    finally:
+        app.dependency_overrides.pop(factory.get_store)
+        if previous is not None:
+            app.dependency_overrides[factory.get_store] = previous
+
+    assert first.status_code == 200
+    assert (unchanged.status_code, unchanged.headers["etag"]) == (304, etag)
+    assert unchanged.content == b""
+    assert edited.status_code == 200
+    assert edited.headers["etag"] != etag
+    assert "mu   : 1.0000" in edited.text
+    assert elsewhere.status_code == 200
+    assert elsewhere.headers["etag"] != edited.headers["etag"]
+    assert ub.headers["etag"] == elsewhere.headers["etag"]
+    assert restarted.status_code == 304
+
+
+def test_changes_are_pushed_to_event_streams(tmp_path: Path):
+    store = PicklingHklCalcStore(tmp_path)
+    other_process = PicklingHklCalcStore(tmp_path)
+    asyncio.run(store.create("test"))
+
+    async def follow_changes():
+        stream = await events.stream_events("test", store, poll_interval=0.05)
+        received = [await stream.__anext__()]
+
+        await service.set_constraint("test", "mu", 1, store)
+        received.append(await stream.__anext__())
+
+        await service.remove_constraint("test", "mu", other_process)
+        received.append(await stream.__anext__())
+        while received[-1].startswith(b":"):
+            received.append(await stream.__anext__())
+
+        subscribed = events.get_event_hub().subscribers(store, "test")
+        await stream.aclose()
+        return received, subscribed
+
+    received, subscribed = asyncio.run(follow_changes())
+    parsed = [
+        json.loads(message.decode().split("data: ")[1])
+        for message in received
+        if not message.startswith(b":")
+    ]
+
+    assert [event["kind"] for event in parsed] == [
+        "connected",
+        "set_constraint",
+        "external",
+    ]
+    assert parsed[0]["version"] < parsed[1]["version"] < parsed[2]["version"]
+    assert received[1].startswith(f"id: {parsed[1]['version']}\n".encode())
+    assert parsed[2]["etag"] == f'"{token_tag(store._stamp("test"))}"'
+    assert subscribed == 1
+    assert events.get_event_hub().subscribers(store, "test") == 0